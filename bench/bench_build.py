@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+import argparse
+import contextlib
+import json
+import math
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from synthetic import (
+    MP3_FRAME,
+    REPO_DIR,
+    generate_checklist,
+    generate_image_table,
+    generate_recording_file_names,
+    load_db,
+    write_tables,
+)
+from create_tables import (
+    METADATA_FILE,
+    add_recording_metadata,
+    create_recording_table,
+    create_tables,
+    index_recordings,
+    parse_recording_file_name,
+    scan_recordings,
+)
+from bench_http import git_commit
+from jacamar import snapshot
+
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+
+DEFAULT_SCALES = ["350:1250", "1000:5000", "3000:20000", "10000:100000"]
+
+
+def make_recordings_dir(dir, species_table, n_recordings):
+    # One frame each is enough: the build only looks at file names, sizes and MPEG frame
+    # headers.
+    os.makedirs(dir)
+    for file in generate_recording_file_names(species_table, n_recordings):
+        with open(os.path.join(dir, file), "wb") as fp:
+            fp.write(MP3_FRAME)
+
+
+def time_phase(function, repeat):
+    # Returns the last result and the median wall time in seconds.
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings)
+
+
+def bench_scale(work_dir, n_species, n_recordings, repeat):
+    # Times each build phase of `make db` at one scale. work_dir is used as the working
+    # directory, as the Makefile targets expect.
+    os.chdir(work_dir)
+    os.makedirs("tables")
+    checklist = generate_checklist(n_species)
+    _, _, _, species_table = create_tables(checklist)
+    make_recordings_dir("recordings", species_table, n_recordings)
+    files = [file for file in os.listdir("recordings") if file.endswith(".mp3")]
+
+    phases = {}
+    tables, phases["create_tables"] = time_phase(lambda: create_tables(checklist), repeat)
+    order_table, family_table, genus_table, species_table = tables
+    _, phases["listdir"] = time_phase(lambda: os.listdir("recordings"), repeat)
+    recordings, phases["parse_recording_file_name"] = time_phase(
+        lambda: [parse_recording_file_name(file) for file in files], repeat
+    )
+    _, phases["index_recordings"] = time_phase(lambda: index_recordings(recordings), repeat)
+    recording_table, phases["create_recording_table"] = time_phase(
+        lambda: create_recording_table("recordings", species_table), repeat
+    )
+
+    def extract_metadata():
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(METADATA_FILE)
+        add_recording_metadata(recording_table, METADATA_FILE)
+
+    _, phases["recording_metadata"] = time_phase(extract_metadata, repeat)
+    _, phases["recording_metadata_cached"] = time_phase(
+        lambda: add_recording_metadata(recording_table, METADATA_FILE), repeat
+    )
+
+    all_tables = {
+        "order": order_table,
+        "family": family_table,
+        "genus": genus_table,
+        "species": species_table,
+        "recording": recording_table,
+        "image": generate_image_table(species_table),
+    }
+    _, phases["write_tables"] = time_phase(lambda: write_tables("tables", all_tables), repeat)
+    _, phases["write_snapshot"] = time_phase(
+        lambda: snapshot.write("tables/taxonomy.snapshot", time.time_ns(), *all_tables.values()),
+        repeat,
+    )
+    _, phases["scan_recordings"] = time_phase(lambda: scan_recordings("recordings"), repeat)
+
+    def load():
+        with contextlib.suppress(FileNotFoundError):
+            os.remove("jacamar.sqlite")
+        load_db(work_dir, "jacamar.sqlite")
+
+    _, phases["load_tables.sql"] = time_phase(load, repeat)
+
+    assert len(recording_table) == n_recordings, "synthetic recordings failed to match"
+    return {
+        "species": n_species,
+        "recordings": n_recordings,
+        "phases_s": phases,
+        "db_bytes": os.path.getsize("jacamar.sqlite"),
+    }
+
+
+def scaling_exponents(results):
+    # For each phase, k in time ~ n^k between consecutive scales, where n is the number
+    # of recordings (the scales grow species and recordings together).
+    exponents = {}
+    for before, after in zip(results, results[1:]):
+        growth = math.log(after["recordings"] / before["recordings"])
+        for phase, seconds in after["phases_s"].items():
+            previous = before["phases_s"][phase]
+            if previous > 0 and seconds > 0 and growth:
+                exponents.setdefault(phase, []).append(math.log(seconds / previous) / growth)
+    return exponents
+
+
+def print_results(results):
+    phases = list(results[0]["phases_s"])
+    print(f"{'phase':28}" + "".join(f"{r['species']:>8}:{r['recordings']:<8}" for r in results))
+    for phase in phases:
+        print(
+            f"{phase:28}"
+            + "".join(f"{1000 * r['phases_s'][phase]:>12.1f} ms  " for r in results)
+        )
+    for phase, exponents in scaling_exponents(results).items():
+        print(f"{phase:28} scales as n^" + " n^".join(f"{k:.2f}" for k in exponents))
+
+
+def compare(report, baseline):
+    print(f"\ncompared with {baseline.get('commit')} ({baseline.get('time')}):")
+    before_by_scale = {(r["species"], r["recordings"]): r for r in baseline["scales"]}
+    for result in report["scales"]:
+        before = before_by_scale.get((result["species"], result["recordings"]))
+        if before is None:
+            continue
+        changes = "  ".join(
+            f"{phase} {100 * (seconds - before['phases_s'][phase]) / before['phases_s'][phase]:+.1f}%"
+            for phase, seconds in result["phases_s"].items()
+            if before["phases_s"].get(phase)
+        )
+        print(f"{result['species']}:{result['recordings']}  {changes}")
+
+
+def parse_scale(value):
+    n_species, n_recordings = value.split(":")
+    return int(n_species), int(n_recordings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time each phase of the table build and database load at several scales."
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        type=parse_scale,
+        default=[parse_scale(scale) for scale in DEFAULT_SCALES],
+        metavar="SPECIES:RECORDINGS",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per phase; the median is kept")
+    parser.add_argument("--output", help="JSON report path (default: bench/results/)")
+    parser.add_argument("--compare", help="JSON report to compare against")
+    args = parser.parse_args()
+    args.output = args.output and os.path.abspath(args.output)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    results = []
+    cwd = os.getcwd()
+    for n_species, n_recordings in args.scales:
+        work_dir = tempfile.mkdtemp(prefix="jacamar-bench-build-")
+        try:
+            results.append(bench_scale(work_dir, n_species, n_recordings, args.repeat))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
+    print_results(results)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": args.repeat,
+        "scales": results,
+        "scaling_exponents": scaling_exponents(results),
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"build-{report['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"\nwrote {output}")
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(report, json.load(fp))
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+from synthetic import REPO_DIR
+
+sys.path.insert(0, REPO_DIR)
+
+DATA_DIR = os.path.join(REPO_DIR, "bench", "data")
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+
+
+def load_ids(db_file):
+    connection = sqlite3.connect(db_file)
+    ids = {}
+    for name, query in [
+        ("family", "select id from family"),
+        ("species", "select id from species"),
+        ("recording", "select id from recording"),
+        ("image", "select id from image"),
+        ("image_digest", "select distinct sha256 from image where sha256 is not null"),
+    ]:
+        ids[name] = [id for id, in connection.execute(query)]
+    connection.close()
+    return ids
+
+
+def form(**fields):
+    return {
+        "body": urlencode(fields),
+        "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+    }
+
+
+def image_answer_with_token(ids, rng):
+    # An answer checked from its token alone; the token's answer need not be the real one.
+    from jacamar import tokens
+
+    image_id, species_id = rng.choice(ids["image"]), rng.choice(ids["species"])
+    token = tokens.issue("image", image_id, {"species_id": rng.choice(ids["species"])})
+    return (
+        "POST",
+        "/api/image-quiz",
+        {"json": {"species_id": species_id, "image_id": image_id, "token": token}},
+    )
+
+
+# name -> function(ids, rng) returning (method, path, simulate_request keyword arguments).
+ROUTES = {
+    "GET /recordings": lambda ids, rng: ("GET", "/recordings", {}),
+    "GET /recordings/{id}": lambda ids, rng: (
+        "GET",
+        "/recordings/%d" % rng.choice(ids["recording"]),
+        {},
+    ),
+    "GET /recordings/{id} Range": lambda ids, rng: (
+        "GET",
+        "/recordings/%d" % rng.choice(ids["recording"]),
+        {"headers": {"Range": "bytes=0-65535"}},
+    ),
+    "GET /recordings/{id}?start&duration": lambda ids, rng: (
+        "GET",
+        "/recordings/%d" % rng.choice(ids["recording"]),
+        {"params": {"start": "1", "duration": "3"}},
+    ),
+    "POST /recordings": lambda ids, rng: (
+        "POST",
+        "/recordings",
+        form(species_id=rng.choice(ids["species"]), recording_id=rng.choice(ids["recording"])),
+    ),
+    "GET /images/{family_id}": lambda ids, rng: (
+        "GET",
+        "/images/%d" % rng.choice(ids["family"]),
+        {},
+    ),
+    "GET /image-files/{digest}": lambda ids, rng: (
+        "GET",
+        "/image-files/" + rng.choice(ids["image_digest"]),
+        {},
+    ),
+    "GET /recording-quiz": lambda ids, rng: ("GET", "/recording-quiz", {}),
+    "POST /recording-quiz": lambda ids, rng: (
+        "POST",
+        "/recording-quiz",
+        form(family_id=rng.choice(ids["family"]), recording_id=rng.choice(ids["recording"])),
+    ),
+    "GET /image-quiz": lambda ids, rng: ("GET", "/image-quiz", {}),
+    "POST /image-quiz": lambda ids, rng: (
+        "POST",
+        "/image-quiz",
+        form(species_id=rng.choice(ids["species"]), image_id=rng.choice(ids["image"])),
+    ),
+    "GET /api/recording-quiz": lambda ids, rng: ("GET", "/api/recording-quiz", {}),
+    "POST /api/recording-quiz": lambda ids, rng: (
+        "POST",
+        "/api/recording-quiz",
+        {
+            "json": {
+                "family_id": rng.choice(ids["family"]),
+                "recording_id": rng.choice(ids["recording"]),
+            }
+        },
+    ),
+    "GET /api/image-quiz": lambda ids, rng: ("GET", "/api/image-quiz", {}),
+    "POST /api/image-quiz": lambda ids, rng: (
+        "POST",
+        "/api/image-quiz",
+        {"json": {"species_id": rng.choice(ids["species"]), "image_id": rng.choice(ids["image"])}},
+    ),
+    "POST /api/image-quiz token": lambda ids, rng: image_answer_with_token(ids, rng),
+    "GET /api/recording-quiz/deck": lambda ids, rng: (
+        "GET",
+        "/api/recording-quiz/deck",
+        {"params": {"size": "10"}},
+    ),
+    "GET /api/image-quiz/deck": lambda ids, rng: (
+        "GET",
+        "/api/image-quiz/deck",
+        {"params": {"size": "10"}},
+    ),
+    "GET /metrics": lambda ids, rng: ("GET", "/metrics", {}),
+}
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def bench_route(client, route, ids, n_requests, n_warmup, rng, headers=None):
+    def make_request():
+        method, path, kwargs = ROUTES[route](ids, rng)
+        if headers:
+            kwargs["headers"] = dict(headers, **kwargs.get("headers", {}))
+        return method, path, kwargs
+
+    for _ in range(n_warmup):
+        method, path, kwargs = make_request()
+        client.simulate_request(method, path, **kwargs)
+
+    latencies = []
+    errors = 0
+    response_bytes = 0
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        method, path, kwargs = make_request()
+        t0 = time.perf_counter()
+        result = client.simulate_request(method, path, **kwargs)
+        latencies.append(time.perf_counter() - t0)
+        response_bytes += len(result.content)
+        if result.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": n_requests,
+        "errors": errors,
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p50_ms": 1000 * percentile(latencies, 0.50),
+        "p95_ms": 1000 * percentile(latencies, 0.95),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "throughput_rps": n_requests / elapsed,
+        "mean_response_bytes": response_bytes / n_requests,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    data_dir = os.path.join(DATA_DIR, f"{args.species}-{args.recordings}")
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(REPO_DIR, "bench", "synthetic.py"),
+            data_dir,
+            "--species",
+            str(args.species),
+            "--recordings",
+            str(args.recordings),
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    # /metrics sums the files of every process that served requests, as it would those of
+    # a server's workers; start from none, as `make serve` does.
+    shutil.rmtree(os.path.join(data_dir, "metrics"), ignore_errors=True)
+
+    results = {}
+    for route in args.routes or list(ROUTES):
+        results[route] = run_route_process(args, data_dir, route)
+        print_result(route, results[route])
+
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "scale": {"species": args.species, "recordings": args.recordings},
+        "requests_per_route": args.requests,
+        "accept_encoding": args.accept_encoding,
+        "asgi": args.asgi,
+        "routes": results,
+        "peak_rss_kb": max(result["peak_rss_kb"] for result in results.values()),
+    }
+
+
+def run_route_process(args, data_dir, route):
+    # Each route is benchmarked in a fresh process, so that its peak RSS is its own rather
+    # than the high-water mark of every route benchmarked before it.
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--route-process",
+        data_dir,
+        route,
+        "--requests",
+        str(args.requests),
+        "--warmup",
+        str(args.warmup),
+        "--seed",
+        str(args.seed),
+    ]
+    if args.accept_encoding:
+        command += ["--accept-encoding", args.accept_encoding]
+    if args.asgi:
+        command.append("--asgi")
+    output = subprocess.run(
+        command, check=True, stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def bench_route_process(args, data_dir, route):
+    db_file = os.path.join(data_dir, "jacamar.sqlite")
+    ids = load_ids(db_file)
+
+    # Recording paths are relative to the dataset directory.
+    os.chdir(data_dir)
+    from jacamar import settings
+
+    settings.db_file = db_file
+    settings.snapshot_file = os.path.join(data_dir, "tables", "taxonomy.snapshot")
+    settings.image_store_dir = os.path.join(data_dir, "images")
+    settings.metrics_dir = os.path.join(data_dir, "metrics")
+    settings.answer_token_key_file = os.path.join(data_dir, "answer_token_key")
+    settings.log_level = "WARNING"
+    from falcon import testing
+
+    if args.asgi:
+        from jacamar.asgi import application
+    else:
+        from jacamar.app import application
+
+    client = testing.TestClient(application)
+    headers = {"Accept-Encoding": args.accept_encoding} if args.accept_encoding else None
+    return bench_route(
+        client, route, ids, args.requests, args.warmup, random.Random(args.seed), headers
+    )
+
+
+def print_result(route, result):
+    print(
+        f"{route:40} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+        f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} req/s  "
+        f"errors {result['errors']}  peak RSS {result['peak_rss_kb']} KiB"
+    )
+
+
+def compare(report, baseline):
+    print(f"\ncompared with {baseline.get('commit')} ({baseline.get('time')}):")
+    for route, result in report["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            continue
+        changes = "  ".join(
+            f"{key} {100 * (result[key] - before[key]) / before[key]:+6.1f}%"
+            for key in ["p50_ms", "p99_ms", "throughput_rps"]
+            if before[key]
+        )
+        print(f"{route:40} {changes}")
+    print(f"{'peak RSS':40} {report['peak_rss_kb']} KiB (was {baseline['peak_rss_kb']} KiB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive every jacamar.app route in-process over a synthetic database."
+    )
+    parser.add_argument("--species", type=int, default=350)
+    parser.add_argument("--recordings", type=int, default=1250)
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--routes", nargs="*", choices=list(ROUTES), metavar="ROUTE")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--accept-encoding", help='Accept-Encoding header sent with every request, e.g. "gzip"'
+    )
+    parser.add_argument(
+        "--asgi", action="store_true", help="benchmark jacamar.asgi instead of jacamar.app"
+    )
+    parser.add_argument("--output", help="JSON report path (default: bench/results/<commit>.json)")
+    parser.add_argument("--compare", help="JSON report to compare against")
+    parser.add_argument("--route-process", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.route_process:
+        data_dir, route = args.route_process
+        print(json.dumps(bench_route_process(args, data_dir, route)))
+        sys.exit()
+    args.output = args.output and os.path.abspath(args.output)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    report = run(args)
+    name = f"http-{report['commit'] or 'unknown'}-{args.species}-{args.recordings}"
+    if args.asgi:
+        name += "-asgi"
+    if args.accept_encoding:
+        name += "-" + "".join(c for c in args.accept_encoding if c.isalnum())
+    output = args.output or os.path.join(RESULTS_DIR, name + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"\nwrote {output}")
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(report, json.load(fp))
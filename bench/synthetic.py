@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+import argparse
+import hashlib
+import os
+import random
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.join(REPO_DIR, "bin"))
+
+from create_tables import (  # noqa: E402
+    FAMILY_DATA,
+    RECORDING_COLUMNS,
+    create_tables,
+    parse_recording_file_name,
+    recording_kind,
+    scan_recordings,
+    write_manifest,
+    write_table,
+)
+from jacamar import mp3  # noqa: E402
+from jacamar import snapshot  # noqa: E402
+
+LOAD_TABLES_SQL = os.path.join(REPO_DIR, "bin", "load_tables.sql")
+
+TABLE_COLUMNS = {
+    "order": ["id", "name", "english_name"],
+    "family": ["id", "name", "english_name", "order_id", "weight"],
+    "genus": ["id", "name", "english_name", "family_id"],
+    "species": ["id", "name", "english_name", "genus_id"],
+    "recording": RECORDING_COLUMNS,
+    "image": ["id", "url", "species_id", "sha256"],
+}
+
+RECORDING_TYPES = ["Song", "Call", "Song ()", "Call and song", "Dawn song", "Alarm call", "Duet"]
+
+# One MPEG-1 layer III frame (128 kbit/s, 44.1 kHz) of silence.
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x00]) + bytes(413)
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def letters(n):
+    # 0 -> "a", 25 -> "z", 26 -> "ba": unique names that recording file names can contain.
+    name = ""
+    while True:
+        n, r = divmod(n, 26)
+        name = chr(ord("a") + r) + name
+        if n == 0:
+            return name
+
+
+def generate_checklist(n_species, species_per_genus=4):
+    # A checklist in the format of input/checklist.tsv, with n_species spread evenly over
+    # the families create_tables knows about.
+    families = list(FAMILY_DATA)
+    lines = []
+    species_id = 0
+    for i, family in enumerate(families):
+        lines.append(f"Family {letters(i).title()}: {family}\n")
+        count = n_species // len(families) + (1 if i < n_species % len(families) else 0)
+        for j in range(count):
+            genus = family[:-4] + letters(j // species_per_genus)
+            species_id += 1
+            english_name = f"{letters(species_id).title()} Bird"
+            lines.append(f"{species_id}\t{english_name}\t{genus} {letters(j)}\n")
+    return lines
+
+
+def generate_recording_file_names(species_table, n_recordings, seed=0):
+    # Archive-style names, e.g. "0012 3 Bcd Bird 3 Song.mp3", spread round-robin over the
+    # species.
+    rng = random.Random(seed)
+    for i in range(n_recordings):
+        species = species_table[i % len(species_table)]
+        n = i // len(species_table) + 1
+        type = rng.choice(RECORDING_TYPES)
+        yield f"{species['id']:04d} {n} {species['english_name']} {n} {type}.mp3"
+
+
+def generate_image_table(species_table, digests=()):
+    # One image per species, pointing round-robin at the stored images with the given
+    # digests, if any.
+    return [
+        {
+            "id": species["id"],
+            "url": f"http://images.invalid/{species['id']}.jpg",
+            "species_id": species["id"],
+            "sha256": digests[i % len(digests)] if digests else "",
+        }
+        for i, species in enumerate(species_table)
+    ]
+
+
+def write_tables(tables_dir, tables):
+    # tables: {name: rows}, written as tables_dir/<name>.tsv in the layout load_tables.sql
+    # imports.
+    for name, rows in tables.items():
+        write_table(rows, TABLE_COLUMNS[name], os.path.join(tables_dir, f"{name}.tsv"))
+
+
+def write_image(images_dir, data):
+    # Into a content-addressed store laid out as jacamar.images keeps it.
+    digest = hashlib.sha256(data).hexdigest()
+    os.makedirs(os.path.join(images_dir, digest[:2]), exist_ok=True)
+    with open(os.path.join(images_dir, digest[:2], digest), "wb") as fp:
+        fp.write(data)
+    return digest
+
+
+def write_mp3(path, seconds):
+    with open(path, "wb") as fp:
+        fp.write(MP3_FRAME * int(seconds * MP3_FRAMES_PER_SECOND))
+
+
+def build_dataset(out_dir, n_species, n_recordings, n_audio_files=16, n_image_files=16, seed=0):
+    # Writes tables/*.tsv, tables/taxonomy.snapshot, tables/manifest.json and a loaded
+    # jacamar.sqlite under out_dir. Recording rows point at a small pool of real mp3 files
+    # in out_dir/recordings, relative to out_dir, and image rows at a pool of images stored
+    # in out_dir/images.
+    db_file = os.path.join(out_dir, "jacamar.sqlite")
+    if os.path.exists(db_file):
+        return db_file
+
+    rng = random.Random(seed)
+    tables_dir = os.path.join(out_dir, "tables")
+    recordings_dir = os.path.join(out_dir, "recordings")
+    os.makedirs(tables_dir, exist_ok=True)
+    os.makedirs(recordings_dir, exist_ok=True)
+
+    audio_files = []
+    audio_metadata = []
+    for i in range(n_audio_files):
+        audio_file = os.path.join("recordings", f"pool-{i:02d}.mp3")
+        write_mp3(os.path.join(out_dir, audio_file), seconds=rng.randint(5, 60))
+        audio_files.append(audio_file)
+        audio_metadata.append(mp3.read_metadata(os.path.join(out_dir, audio_file))._asdict())
+
+    checklist = generate_checklist(n_species)
+    order_table, family_table, genus_table, species_table = create_tables(checklist)
+    recording_table = []
+    for i, file in enumerate(generate_recording_file_names(species_table, n_recordings, seed)):
+        type = parse_recording_file_name(file)["type"]
+        recording_table.append(
+            {
+                "id": i + 1,
+                "path": audio_files[i % len(audio_files)],
+                "species_id": species_table[i % len(species_table)]["id"],
+                "type": type.lower(),
+                "kind": recording_kind(type),
+                **audio_metadata[i % len(audio_files)],
+            }
+        )
+    digests = [
+        write_image(os.path.join(out_dir, "images"), PNG_SIGNATURE + bytes([i]) * 20000)
+        for i in range(n_image_files)
+    ]
+    image_table = generate_image_table(species_table, digests)
+    write_tables(
+        tables_dir,
+        {
+            "order": order_table,
+            "family": family_table,
+            "genus": genus_table,
+            "species": species_table,
+            "recording": recording_table,
+            "image": image_table,
+        },
+    )
+    build_id = time.time_ns()
+    snapshot.write(
+        os.path.join(tables_dir, "taxonomy.snapshot"),
+        build_id,
+        order_table,
+        family_table,
+        genus_table,
+        species_table,
+        recording_table,
+        image_table,
+    )
+    write_manifest(
+        os.path.join(tables_dir, "manifest.json"),
+        build_id,
+        checklist,
+        scan_recordings(recordings_dir),
+    )
+
+    load_db(out_dir, db_file + ".tmp")
+    os.replace(db_file + ".tmp", db_file)
+    return db_file
+
+
+def load_db(dir, db_file):
+    # Runs bin/load_tables.sql, which imports tables/*.tsv relative to the working directory
+    # and reads bin/*.sql relative to the repository.
+    with open(LOAD_TABLES_SQL) as fp:
+        script = fp.read().replace(".read bin/", f".read {REPO_DIR}/bin/")
+    subprocess.run(
+        ["sqlite3", "--bail", db_file],
+        input=script,
+        universal_newlines=True,
+        cwd=dir,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("out_dir")
+    parser.add_argument("--species", type=int, default=350)
+    parser.add_argument("--recordings", type=int, default=1250)
+    args = parser.parse_args()
+    print(build_dataset(args.out_dir, args.species, args.recordings))
@@ -1,12 +1,21 @@
 #!/usr/bin/env python
+import csv
+import json
 import os
 import re
 import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from operator import itemgetter
 
 from clint.textui import colored
-from pandas import DataFrame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from jacamar import mp3  # noqa: E402
+from jacamar import snapshot  # noqa: E402
 
 red = partial(colored.red, bold=True)
 
@@ -75,6 +84,34 @@ FAMILY_DATA = {
 }
 
 
+MANIFEST_FILE = "tables/manifest.json"
+IMAGE_FILE = "tables/image.tsv"
+SNAPSHOT_FILE = "tables/taxonomy.snapshot"
+METADATA_FILE = "tables/recording_metadata.json"
+
+RECORDING_COLUMNS = ["id", "path", "species_id", "type", "kind"] + list(mp3.Metadata._fields)
+
+# E.g. "2326 1 Dusky-chested Flycatcher 1 Song.mp3"
+RECORDING_FILE_NAME = re.compile(
+    r"""
+    ^
+    \d+
+    \s+
+    \d+
+    \s+
+    (?P<english_name>[a-zA-Z- ']+)
+    \s+
+    \d+
+    \s+
+    (?P<type>[^.]+)
+    \.mp3$
+    """,
+    re.VERBOSE,
+)
+
+SPECIES_LINE = re.compile(r"^\d+\t")
+
+
 def create_tables(fp):
     family_table = {}
     genus_table = {}
@@ -118,11 +155,8 @@ def create_tables(fp):
 
 def create_recording_table(dir, species_table):
     recording_table = []
-    recordings = list(
-        filter(
-            bool,
-            (parse_recording_file_name(file) for file in os.listdir(dir) if file.endswith(".mp3")),
-        )
+    recordings = index_recordings(
+        parse_recording_file_name(file) for file in os.listdir(dir) if file.endswith(".mp3")
     )
     recording_id = 0
     for species in species_table:
@@ -135,6 +169,7 @@ def create_recording_table(dir, species_table):
                         "id": recording_id,
                         "path": os.path.join(dir, recording["file"]),
                         "type": recording["type"].lower(),
+                        "kind": recording_kind(recording["type"]),
                         "species_id": species["id"],
                     }
                 )
@@ -144,22 +179,73 @@ def create_recording_table(dir, species_table):
     return recording_table
 
 
+def add_recording_metadata(recording_table, metadata_file, max_workers=None):
+    # Sets the mp3.Metadata columns of each recording, None where the file has no MPEG
+    # audio.
+    metadata = read_recording_metadata(
+        sorted({recording["path"] for recording in recording_table}), metadata_file, max_workers
+    )
+    for recording in recording_table:
+        recording.update(metadata[recording["path"]] or dict.fromkeys(mp3.Metadata._fields))
+
+
+def read_recording_metadata(paths, metadata_file, max_workers=None):
+    # {path: metadata dict or None}. Only files that are new or modified since they were
+    # cached in metadata_file are parsed, in a process pool; the cache is then rewritten
+    # without the files that no longer exist.
+    cache = {}
+    if os.path.exists(metadata_file):
+        with open(metadata_file) as fp:
+            cache = json.load(fp)
+
+    result = {}
+    stale = []
+    for path in paths:
+        entry = cache.get(path)
+        if entry is not None and entry["stat"] == file_stat(path):
+            result[path] = entry["metadata"]
+        else:
+            stale.append(path)
+
+    if stale:
+        workers = max_workers or os.cpu_count() or 1
+        chunksize = max(len(stale) // (workers * 4), 1)
+        with ProcessPoolExecutor(workers) as executor:
+            for path, (stat, metadata) in zip(
+                stale, executor.map(extract_metadata, stale, chunksize=chunksize)
+            ):
+                if metadata is None:
+                    error(f"Failed to read MPEG audio from: {path}")
+                cache[path] = {"stat": stat, "metadata": metadata}
+                result[path] = metadata
+
+    kept = {path: entry for path, entry in cache.items() if path in result or os.path.exists(path)}
+    if stale or len(kept) < len(cache):
+        tmp_path = metadata_file + ".tmp"
+        with open(tmp_path, "w") as fp:
+            # dumps() rather than dump(), which only uses the slower pure-Python encoder.
+            fp.write(json.dumps(kept))
+        os.replace(tmp_path, metadata_file)
+    return result
+
+
+def extract_metadata(path):
+    # Runs in a worker process: ([mtime_ns, size], metadata dict or None).
+    stat = file_stat(path)
+    try:
+        metadata = mp3.read_metadata(path)
+    except (OSError, ValueError):
+        return stat, None
+    return stat, metadata._asdict()
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
 def parse_recording_file_name(file):
-    # E.g. "2326 1 Dusky-chested Flycatcher 1 Song.mp3"
-    regexp = r"""
-    ^
-    \d+
-    \s+
-    \d+
-    \s+
-    (?P<english_name>[a-zA-Z- ']+)
-    \s+
-    \d+
-    \s+
-    (?P<type>[^.]+)
-    \.mp3$
-    """
-    match = re.match(regexp, file, re.VERBOSE)
+    match = RECORDING_FILE_NAME.match(file)
     if not match:
         error(f"Failed to parse file name: {file}")
         return None
@@ -168,11 +254,27 @@ def parse_recording_file_name(file):
     return recording
 
 
-def match_species_recordings(english_name, recordings):
-    canonicalized_english_name = canonicalize_name(english_name)
-    return [
-        r for r in recordings if canonicalize_name(r["english_name"]) == canonicalized_english_name
-    ]
+def recording_kind(type):
+    # Normalize free-text recording types such as "song ()" or "call and song".
+    type = type.lower()
+    if "song" in type:
+        return "song"
+    if "call" in type:
+        return "call"
+    return "other"
+
+
+def index_recordings(recordings):
+    # Parsed recordings by canonical English name; unparseable (None) entries are dropped.
+    index = defaultdict(list)
+    for recording in recordings:
+        if recording:
+            index[canonicalize_name(recording["english_name"])].append(recording)
+    return index
+
+
+def match_species_recordings(english_name, recordings_index):
+    return recordings_index.get(canonicalize_name(english_name), [])
 
 
 def canonicalize_name(name):
@@ -180,7 +282,7 @@ def canonicalize_name(name):
 
 
 def is_species_line(line):
-    return re.match("^\d+\t", line)
+    return SPECIES_LINE.match(line)
 
 
 def parse_species(line):
@@ -194,6 +296,50 @@ def parse_family(line):
     return name.strip(), english_name.strip()
 
 
+def write_table(table, columns, path):
+    with open(path, "w", newline="") as fp:
+        writer = csv.writer(fp, delimiter="\t", lineterminator="\n")
+        for row in table:
+            writer.writerow([row[column] for column in columns])
+
+
+def read_image_table(path):
+    # The images fetched by bin/fetch_wikipedia_images.py for the previous build, if any;
+    # species ids are stable across builds of the same checklist.
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as fp:
+        return [
+            {"id": int(id), "url": url, "species_id": int(species_id), "sha256": sha256 or None}
+            for id, url, species_id, sha256 in csv.reader(fp, delimiter="\t")
+        ]
+
+
+def scan_recordings(dir):
+    # {file name: [size, mtime_ns]} for every recording in dir.
+    recordings = {}
+    for entry in os.scandir(dir):
+        if entry.name.endswith(".mp3"):
+            stat = entry.stat()
+            recordings[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return recordings
+
+
+def manifest_json(build_id, checklist, recordings):
+    # The id and inputs of a build. bin/load_tables.sql stores the manifest of the tables in
+    # the database, so that bin/update_db.py applies what changed since the database was
+    # built, whichever tables were written since, and the server only uses the snapshot of
+    # the same build.
+    return json.dumps({"build_id": build_id, "checklist": checklist, "recordings": recordings})
+
+
+def write_manifest(path, build_id, checklist, recordings):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        fp.write(manifest_json(build_id, checklist, recordings))
+    os.replace(tmp_path, path)
+
+
 def error(msg):
     print(red(msg), file=sys.stderr)
 
@@ -201,17 +347,34 @@ def error(msg):
 if __name__ == "__main__":
     [checklist_file, recordings_dir] = sys.argv[1:]
     with open(checklist_file) as fp:
-        order_table, family_table, genus_table, species_table = create_tables(fp)
+        checklist = fp.readlines()
+    order_table, family_table, genus_table, species_table = create_tables(checklist)
 
     recording_table = create_recording_table(recordings_dir, species_table)
+    add_recording_metadata(recording_table, METADATA_FILE)
 
     for table, columns, path in [
         (order_table, ["id", "name", "english_name"], "tables/order.tsv"),
         (family_table, ["id", "name", "english_name", "order_id", "weight"], "tables/family.tsv"),
         (genus_table, ["id", "name", "english_name", "family_id"], "tables/genus.tsv"),
         (species_table, ["id", "name", "english_name", "genus_id"], "tables/species.tsv"),
-        (recording_table, ["id", "path", "species_id", "type"], "tables/recording.tsv"),
+        (recording_table, RECORDING_COLUMNS, "tables/recording.tsv"),
     ]:
-        DataFrame.from_records(table, columns=columns).to_csv(
-            path, header=False, index=False, sep="\t"
-        )
+        write_table(table, columns, path)
+
+    species_ids = {species["id"] for species in species_table}
+    image_table = [
+        image for image in read_image_table(IMAGE_FILE) if image["species_id"] in species_ids
+    ]
+    build_id = time.time_ns()
+    snapshot.write(
+        SNAPSHOT_FILE,
+        build_id,
+        order_table,
+        family_table,
+        genus_table,
+        species_table,
+        recording_table,
+        image_table,
+    )
+    write_manifest(MANIFEST_FILE, build_id, checklist, scan_recordings(recordings_dir))
@@ -0,0 +1,73 @@
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fetch_wikipedia_images import FIELDNAMES, TokenBucket, create_session, error, info
+from jacamar.images import image_path, store_image
+
+
+def download_images(image_file, base_url, workers, rate, retries, backoff):
+    # Downloads every image in image_file that has no local copy into the content-addressed
+    # store, and records its SHA-256 in image_file.
+    with open(image_file, newline="") as fp:
+        rows = list(csv.DictReader(fp, fieldnames=FIELDNAMES, delimiter="\t"))
+
+    todo = [row for row in rows if not row["sha256"] or not os.path.exists(image_path(row["sha256"]))]
+    info(f"{len(rows) - len(todo)} images already stored, downloading {len(todo)}")
+
+    session = create_session(workers, retries, backoff)
+    bucket = TokenBucket(rate, capacity=workers)
+
+    def download(url):
+        if base_url:
+            url = urlsplit(url)._replace(scheme=base_url.scheme, netloc=base_url.netloc).geturl()
+        bucket.acquire()
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        return store_image(response.content)
+
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(download, row["url"]): row for row in todo}
+            for future in as_completed(futures):
+                row = futures[future]
+                try:
+                    row["sha256"] = future.result()
+                except Exception as ex:
+                    error(f"{row['url']}: {type(ex).__name__}: {ex}")
+    finally:
+        write_images(image_file, rows)
+
+
+def write_images(image_file, rows):
+    tmp_file = image_file + ".tmp"
+    with open(tmp_file, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=FIELDNAMES, delimiter="\t", lineterminator="\n")
+        writer.writerows(rows)
+    os.replace(tmp_file, image_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-file", default="tables/image.tsv")
+    parser.add_argument(
+        "--base-url", help="fetch from this scheme and host instead of the ones in each URL"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=5.0, help="requests per second")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    args = parser.parse_args()
+    download_images(
+        args.image_file,
+        args.base_url and urlsplit(args.base_url),
+        args.workers,
+        args.rate,
+        args.retries,
+        args.backoff,
+    )
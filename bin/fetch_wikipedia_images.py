@@ -1,20 +1,66 @@
+import argparse
 import csv
+import os
 import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 
 from clint.textui import colored
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 green = partial(colored.green, bold=True)
 red = partial(colored.red, bold=True)
 
+FIELDNAMES = ["id", "url", "species_id", "sha256"]
 
-def fetch_image_url(query):
-    response = requests.get(f"https://en.wikipedia.org/w/index.php?title={query}")
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second on average, in bursts of up to `capacity`.
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(workers, retries, backoff):
+    # One keep-alive connection per worker; transient failures are retried with
+    # exponential backoff, honouring Retry-After.
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_image_url(session, base_url, query):
+    response = session.get(f"{base_url}/w/index.php", params={"title": query}, timeout=30)
     response.raise_for_status()
     html = response.content
     soup = BeautifulSoup(html, features="html5lib")
@@ -24,39 +70,65 @@ def fetch_image_url(query):
     return image_url
 
 
-def fetch_image_urls(db_file, output_file):
-    fieldnames = ["id", "url", "species_id"]
-
-    with open(output_file, "r") as fp:
-        reader = csv.DictReader(fp, fieldnames=fieldnames)
-        rows = list(reader)
-        if rows:
-            species_ids = {int(row["species_id"]) for row in rows}
-            image_id = max((int(row["id"]) for row in rows), default=0)
-
-    with open(output_file, "a", newline="") as fp:
-        writer = csv.DictWriter(fp, fieldnames=fieldnames)
-        cursor = sqlite3.connect(db_file).cursor()
-        query = """
-        select species.id, genus.name, species.name from species join genus on species.genus_id = genus.id
-        """
-        images = []
-        for species_id, genus, species in cursor.execute(query):
-            if species_id in species_ids:
-                info(f"Already have image for {genus} {species}, skipping")
-                continue
+def read_images(output_file):
+    # Returns the species that already have an image and the last image id. A partially
+    # written last line (from an interrupted run) is dropped so that it is fetched again.
+    if not os.path.exists(output_file):
+        return set(), 0
+
+    with open(output_file, "r", newline="") as fp:
+        lines = fp.readlines()
+    if lines and not lines[-1].endswith("\n"):
+        lines.pop()
+        with open(output_file, "w", newline="") as fp:
+            fp.writelines(lines)
+
+    rows = list(csv.DictReader(lines, fieldnames=FIELDNAMES, delimiter="\t"))
+    species_ids = {int(row["species_id"]) for row in rows}
+    image_id = max((int(row["id"]) for row in rows), default=0)
+    return species_ids, image_id
+
+
+def fetch_image_urls(db_file, output_file, base_url, workers, rate, retries, backoff):
+    species_ids, image_id = read_images(output_file)
+
+    cursor = sqlite3.connect(db_file).cursor()
+    query = """
+    select species.id, genus.name, species.name from species join genus on species.genus_id = genus.id
+    order by species.id
+    """
+    todo = []
+    for species_id, genus, species in cursor.execute(query):
+        if species_id in species_ids:
+            info(f"Already have image for {genus} {species}, skipping")
+        else:
+            todo.append((species_id, genus, species))
+
+    session = create_session(workers, retries, backoff)
+    bucket = TokenBucket(rate, capacity=workers)
+
+    def fetch(genus, species):
+        bucket.acquire()
+        return fetch_image_url(session, base_url, f"{genus}_{species}")
+
+    with open(output_file, "a", newline="") as fp, ThreadPoolExecutor(workers) as executor:
+        writer = csv.DictWriter(fp, fieldnames=FIELDNAMES, delimiter="\t", lineterminator="\n")
+        futures = {
+            executor.submit(fetch, genus, species): (species_id, genus, species)
+            for species_id, genus, species in todo
+        }
+        for future in as_completed(futures):
+            species_id, genus, species = futures[future]
             try:
-                url = fetch_image_url(f"{genus}_{species}")
+                url = future.result()
             except Exception as ex:
-                error(f"{type(ex).__name__}: {ex}")
+                error(f"{genus} {species}: {type(ex).__name__}: {ex}")
                 continue
             image_id += 1
             image = {"id": image_id, "species_id": species_id, "url": url}
             print(image)
             writer.writerow(image)
             fp.flush()
-            species_ids.add(species_id)
-            time.sleep(1)
 
 
 def info(message):
@@ -68,6 +140,21 @@ def error(msg):
 
 
 if __name__ == "__main__":
-    [db_file] = sys.argv[1:]
-    output_file = "tables/image.tsv"
-    fetch_image_urls(db_file, output_file)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db_file")
+    parser.add_argument("--output-file", default="tables/image.tsv")
+    parser.add_argument("--base-url", default="https://en.wikipedia.org")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    args = parser.parse_args()
+    fetch_image_urls(
+        args.db_file,
+        args.output_file,
+        args.base_url.rstrip("/"),
+        args.workers,
+        args.rate,
+        args.retries,
+        args.backoff,
+    )
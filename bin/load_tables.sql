@@ -1,9 +1,12 @@
+pragma journal_mode = wal;
+
 drop table if exists _order;
 drop table if exists family;
 drop table if exists genus;
 drop table if exists species;
 drop table if exists recording;
 drop table if exists image;
+drop table if exists build;
 
 create table _order (
   id integer primary key,
@@ -41,6 +44,13 @@ create table recording (
   path text not null,
   species_id integer,
   type text not null,
+  kind text not null check (kind in ('song', 'call', 'other')),
+  -- Of the file, from bin/create_tables.py; null if it could not be read.
+  size integer,
+  duration real,
+  bitrate integer,
+  sample_rate integer,
+  frame_count integer,
   foreign key (species_id) references species (id)
 );
 
@@ -48,9 +58,15 @@ create table image (
   id integer primary key,
   url text not null,
   species_id integer,
+  sha256 text,
   foreign key (species_id) references species (id)
 );
 
+-- One row: the manifest of the tables loaded, read and updated by bin/update_db.py.
+create table build (
+  manifest text
+);
+
 .mode tabs
 .import tables/order.tsv _order
 .import tables/family.tsv family
@@ -58,3 +74,17 @@ create table image (
 .import tables/species.tsv species
 .import tables/recording.tsv recording
 .import tables/image.tsv image
+update image set sha256 = null where sha256 = '';
+update recording set size = null, duration = null, bitrate = null, sample_rate = null,
+  frame_count = null where size = '';
+insert into build (manifest) values (cast(readfile('tables/manifest.json') as text));
+
+create index genus_family_id on genus (family_id);
+create index species_genus_id on species (genus_id);
+create index recording_species_id on recording (species_id, kind, type);
+create index recording_kind on recording (kind, species_id);
+create index image_species_id on image (species_id, url);
+
+.read bin/taxon.sql
+
+analyze;
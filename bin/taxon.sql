@@ -0,0 +1,36 @@
+-- One row per species with its genus, family, order and a representative image (the one
+-- with the lowest id), so that the server can look species up without joining the
+-- taxonomy tables. Rebuilt from scratch by bin/load_tables.sql and bin/update_db.py.
+
+drop table if exists taxon;
+
+create table taxon (
+  species_id integer primary key,
+  species_name text not null,
+  species_english_name text not null,
+  genus_id integer not null,
+  genus_name text not null,
+  family_id integer not null,
+  family_name text not null,
+  family_english_name text not null,
+  family_weight real not null,
+  order_id integer,
+  order_name text,
+  image_id integer,
+  image_url text,
+  image_sha256 text
+);
+
+insert into taxon
+select species.id, species.name, species.english_name,
+       genus.id, genus.name,
+       family.id, family.name, family.english_name, family.weight,
+       _order.id, _order.name,
+       image.id, image.url, image.sha256
+from species
+inner join genus on genus.id = species.genus_id
+inner join family on family.id = genus.family_id
+left join _order on _order.id = family._order_id
+left join image on image.id = (select min(id) from image where image.species_id = species.id);
+
+create index taxon_family_id on taxon (family_id, genus_name, species_name);
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from create_tables import (
+    METADATA_FILE,
+    ORDER_TABLE,
+    RECORDING_COLUMNS,
+    SNAPSHOT_FILE,
+    canonicalize_name,
+    add_recording_metadata,
+    create_tables,
+    manifest_json,
+    parse_recording_file_name,
+    recording_kind,
+    scan_recordings,
+)
+from jacamar import snapshot
+
+TAXON_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "taxon.sql")
+
+
+def update_db(checklist_file, recordings_dir, db_file):
+    # Applies the changes to the checklist and the recordings directory since the database
+    # was built or last updated, as recorded in its manifest, in one transaction. Rows keep
+    # their ids; new rows are numbered after the current maximum.
+    with open(checklist_file) as fp:
+        checklist = fp.readlines()
+    recordings = scan_recordings(recordings_dir)
+
+    connection = sqlite3.connect(db_file, isolation_level=None)
+    connection.execute("begin immediate")
+    try:
+        manifest = read_manifest(connection)
+        if manifest is None:
+            raise SystemExit(f"{db_file} has no build manifest; rebuild it with `make db`")
+        taxonomy_changed = checklist != manifest["checklist"]
+        if taxonomy_changed:
+            update_taxonomy(connection, checklist)
+        update_recordings(
+            connection,
+            recordings_dir,
+            recordings,
+            manifest["recordings"],
+            rematch=taxonomy_changed,
+        )
+        update_taxon(connection)
+        # Planner statistics, as bin/load_tables.sql gathers them.
+        connection.execute("analyze")
+        # A new build: until its snapshot is written below, the server finds the old
+        # snapshot of another build and queries the database instead.
+        build_id = time.time_ns()
+        connection.execute(
+            "update build set manifest = ?", (manifest_json(build_id, checklist, recordings),)
+        )
+        connection.execute("commit")
+    except BaseException:
+        connection.execute("rollback")
+        connection.close()
+        raise
+
+    try:
+        write_snapshot(connection, SNAPSHOT_FILE, build_id)
+    finally:
+        connection.close()
+
+
+def read_manifest(connection):
+    # None if the database was loaded without tables/manifest.json, or before manifests
+    # were kept in it.
+    try:
+        row = connection.execute("select manifest from build").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def update_taxonomy(connection, checklist):
+    _, family_table, genus_table, species_table = create_tables(checklist)
+
+    family_ids = assign_ids(connection, "select name, id from family", family_table, ["name"])
+    for genus in genus_table:
+        genus["family_id"] = family_ids[genus["family_id"]]
+    genus_ids = assign_ids(connection, "select name, id from genus", genus_table, ["name"])
+    for species in species_table:
+        species["genus_id"] = genus_ids[species["genus_id"]]
+    assign_ids(
+        connection, "select genus_id, name, id from species", species_table, ["genus_id", "name"]
+    )
+
+    for table, columns, keys, rows in [
+        ("_order", ["id", "name", "english_name"], ["id", "name", "english_name"], ORDER_TABLE),
+        (
+            "family",
+            ["id", "name", "english_name", "_order_id", "weight"],
+            ["id", "name", "english_name", "order_id", "weight"],
+            family_table,
+        ),
+        ("genus", ["id", "name", "english_name", "family_id"], None, genus_table),
+        ("species", ["id", "name", "english_name", "genus_id"], None, species_table),
+    ]:
+        replace_rows(connection, table, columns, keys or columns, rows)
+
+    deleted_species = delete_missing(connection, "species", species_table)
+    connection.executemany(
+        "delete from recording where species_id = ?", [(id,) for id in deleted_species]
+    )
+    connection.executemany(
+        "delete from image where species_id = ?", [(id,) for id in deleted_species]
+    )
+    delete_missing(connection, "genus", genus_table)
+    delete_missing(connection, "family", family_table)
+    delete_missing(connection, "_order", ORDER_TABLE)
+
+
+def update_recordings(connection, dir, recordings, previous_recordings, rematch):
+    # Only new and modified files are parsed, unless the taxonomy changed, in which case
+    # every file is matched against the species again.
+    species_ids = {
+        canonicalize_name(english_name): id
+        for id, english_name in connection.execute("select id, english_name from species")
+    }
+    recording_ids = {path: id for id, path in connection.execute("select id, path from recording")}
+    next_id = max(recording_ids.values(), default=0) + 1
+
+    paths = {os.path.join(dir, file) for file in recordings}
+    removed = [id for path, id in recording_ids.items() if path not in paths]
+    rows = []
+    for file in sorted(recordings):
+        if not rematch and previous_recordings.get(file) == recordings[file]:
+            continue
+        path = os.path.join(dir, file)
+        recording = parse_recording_file_name(file)
+        species_id = recording and species_ids.get(canonicalize_name(recording["english_name"]))
+        if species_id is None:
+            if path in recording_ids:
+                removed.append(recording_ids[path])
+            continue
+        id = recording_ids.get(path)
+        if id is None:
+            id = next_id
+            next_id += 1
+        rows.append(
+            {
+                "id": id,
+                "path": path,
+                "species_id": species_id,
+                "type": recording["type"].lower(),
+                "kind": recording_kind(recording["type"]),
+            }
+        )
+
+    add_recording_metadata(rows, METADATA_FILE)
+    replace_rows(connection, "recording", RECORDING_COLUMNS, RECORDING_COLUMNS, rows)
+    connection.executemany("delete from recording where id = ?", [(id,) for id in removed])
+    print(f"recordings: {len(rows)} added or updated, {len(removed)} removed", file=sys.stderr)
+
+
+def update_taxon(connection):
+    # Rebuilds the denormalized taxon table in the current transaction, statement by
+    # statement since executescript() would commit first.
+    with open(TAXON_SQL) as fp:
+        script = fp.read()
+    for statement in sql_statements(script):
+        connection.execute(statement)
+
+
+def sql_statements(script):
+    # The statements of an SQL script, split where SQLite finds one complete, so that a
+    # semicolon in a string literal, a comment or a trigger body does not end it.
+    statements = []
+    start = 0
+    for end, char in enumerate(script):
+        if char == ";" and sqlite3.complete_statement(script[start : end + 1]):
+            statements.append(script[start : end + 1])
+            start = end + 1
+    if script[start:].strip():
+        statements.append(script[start:])
+    return statements
+
+
+def write_snapshot(connection, path, build_id):
+    tables = [
+        select_rows(connection, query)
+        for query in [
+            "select id, name, english_name from _order",
+            "select id, name, english_name, _order_id as order_id, weight from family",
+            "select id, name, english_name, family_id from genus",
+            "select id, name, english_name, genus_id from species",
+            "select id, path, species_id, type, kind from recording",
+            "select id, url, species_id, sha256 from image",
+        ]
+    ]
+    snapshot.write(path, build_id, *tables)
+
+
+def select_rows(connection, query):
+    cursor = connection.execute(query)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def assign_ids(connection, query, table, keys):
+    # Gives each row the id of the existing row with the same natural key (the columns
+    # selected before id in `query`), or a new id. Returns {old id: new id}.
+    existing = {tuple(row[:-1]): row[-1] for row in connection.execute(query)}
+    next_id = max(existing.values(), default=0) + 1
+    ids = {}
+    for row in table:
+        id = existing.get(tuple(row[key] for key in keys))
+        if id is None:
+            id = next_id
+            next_id += 1
+        ids[row["id"]] = id
+        row["id"] = id
+    return ids
+
+
+def replace_rows(connection, table, columns, keys, rows):
+    query = "insert or replace into {} ({}) values ({})".format(
+        table, ", ".join(columns), ", ".join("?" * len(columns))
+    )
+    connection.executemany(query, ([row[key] for key in keys] for row in rows))
+
+
+def delete_missing(connection, table, rows):
+    ids = {row["id"] for row in rows}
+    deleted = [id for id, in connection.execute(f"select id from {table}") if id not in ids]
+    connection.executemany(f"delete from {table} where id = ?", [(id,) for id in deleted])
+    return deleted
+
+
+if __name__ == "__main__":
+    [checklist_file, recordings_dir, db_file] = sys.argv[1:]
+    update_db(checklist_file, recordings_dir, db_file)
@@ -1,10 +1,45 @@
 from jacamar.resources import Image
+from jacamar.resources import ImageFile
 from jacamar.resources import ImageQuiz
+from jacamar.resources import ImageQuizApi
+from jacamar.resources import ImageQuizDeckApi
+from jacamar.resources import Metrics
 from jacamar.resources import Recording
+from jacamar.resources import RecordingApi
 from jacamar.resources import RecordingQuiz
+from jacamar.resources import RecordingQuizApi
+from jacamar.resources import RecordingQuizDeckApi
 
 
 image = Image()
+image_file = ImageFile()
 recording = Recording()
 recording_quiz = RecordingQuiz()
 image_quiz = ImageQuiz()
+metrics = Metrics()
+
+recording_api = RecordingApi()
+recording_quiz_api = RecordingQuizApi()
+image_quiz_api = ImageQuizApi()
+recording_quiz_deck_api = RecordingQuizDeckApi(recording_quiz_api)
+image_quiz_deck_api = ImageQuizDeckApi(image_quiz_api)
+
+
+# Served by both jacamar.app (WSGI) and jacamar.asgi.
+routes = [
+    ('/image-quiz', image_quiz),
+    ('/recording-quiz', recording_quiz),
+
+    ('/recordings/{recording_id:int}', recording),
+    ('/recordings', recording),
+    ('/images/{family_id:int}', image),
+    ('/image-files/{digest}', image_file),
+
+    ('/api/recording-quiz', recording_quiz_api),
+    ('/api/recordings', recording_api),
+    ('/api/image-quiz', image_quiz_api),
+    ('/api/recording-quiz/deck', recording_quiz_deck_api),
+    ('/api/image-quiz/deck', image_quiz_deck_api),
+
+    ('/metrics', metrics),
+]
@@ -1,16 +1,15 @@
 import falcon
 
-from jacamar.api import image
-from jacamar.api import image_quiz
-from jacamar.api import recording
-from jacamar.api import recording_quiz
+from jacamar import log
+from jacamar.api import routes
+from jacamar.compression import CompressionMiddleware
+from jacamar.metrics import MetricsMiddleware
 
 
-api = application = falcon.API()
+log.configure()
 
-api.add_route('/image-quiz', image_quiz)
-api.add_route('/recording-quiz', recording_quiz)
+api = application = falcon.App(middleware=[MetricsMiddleware(), CompressionMiddleware()])
+api.req_options.strip_url_path_trailing_slash = True
 
-api.add_route('/recordings/{recording_id}', recording)
-api.add_route('/recordings', recording)
-api.add_route('/images/{family_id}', image)
+for uri_template, resource in routes:
+    api.add_route(uri_template, resource)
@@ -0,0 +1,76 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import falcon
+import falcon.asgi
+
+from jacamar import log
+from jacamar import settings
+from jacamar.api import routes
+from jacamar.compression import CompressionMiddleware
+from jacamar.metrics import MetricsMiddleware
+
+
+# The resources of jacamar.app, served from an event loop: each responder runs in a bounded
+# thread pool, so SQLite queries, template rendering and file reads never block the loop,
+# and file bodies are streamed without holding a thread between reads. Run with e.g.
+# `gunicorn jacamar.asgi -k uvicorn.workers.UvicornWorker`.
+
+executor = ThreadPoolExecutor(max_workers=settings.asgi_threads,
+                              thread_name_prefix='jacamar-asgi')
+
+
+async def run_in_thread(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+class AsyncStream:
+    # A file (or FileRange) set as a response stream by a resource, read in the thread pool.
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    async def read(self, size=-1):
+        # Larger blocks than falcon asks for, to hand off to a thread less often.
+        if size is not None and size >= 0:
+            size = max(size, settings.asgi_stream_block_size)
+        return await run_in_thread(self.fp.read, size)
+
+    async def close(self):
+        await run_in_thread(self.fp.close)
+
+
+class AsyncResource:
+    # Wraps a resource of jacamar.resources with coroutine responders.
+
+    def __init__(self, resource):
+        self.resource = resource
+        for method in falcon.COMBINED_METHODS:
+            name = 'on_' + method.lower()
+            responder = getattr(resource, name, None)
+            if responder is not None:
+                setattr(self, name, self.wrap(responder))
+
+    @staticmethod
+    def wrap(responder):
+        async def async_responder(request, response, **params):
+            if request.method in ('POST', 'PUT', 'PATCH'):
+                # Read here since the request stream can only be read from the loop; the
+                # resource rejects bodies over max_form_size.
+                request.context.body = await request.bounded_stream.read(
+                    settings.max_form_size + 1)
+            await run_in_thread(responder, request, response, **params)
+            if response.stream is not None:
+                response.stream = AsyncStream(response.stream)
+        return async_responder
+
+
+log.configure()
+
+app = application = falcon.asgi.App(middleware=[MetricsMiddleware(), CompressionMiddleware(run_in_thread)])
+app.req_options.strip_url_path_trailing_slash = True
+
+for uri_template, resource in routes:
+    app.add_route(uri_template, AsyncResource(resource))
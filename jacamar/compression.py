@@ -0,0 +1,204 @@
+import gzip
+import threading
+import time
+from collections import OrderedDict
+
+from jacamar import metrics
+from jacamar import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+compressed_bytes = metrics.Counter(
+    'jacamar_compression_bytes_total',
+    'Size of compressed response bodies before (stage="in") and after (stage="out") '
+    'compression, by encoding.',
+    ['encoding', 'stage'])
+compression_duration = metrics.Histogram(
+    'jacamar_compression_duration_seconds', 'CPU time spent compressing response bodies.',
+    ['encoding'], metrics.DURATION_BUCKETS)
+compression_cache_lookups = metrics.Counter(
+    'jacamar_compression_cache_lookups_total', 'Compressed body cache lookups, by result.',
+    ['result'])
+
+
+def compress_gzip(data):
+    # mtime=0 so that the same page always compresses to the same bytes.
+    return gzip.compress(data, compresslevel=settings.gzip_level, mtime=0)
+
+
+def compress_brotli(data):
+    return brotli.compress(data, quality=settings.brotli_quality)
+
+
+# Supported encodings, most preferred first.
+ENCODERS = OrderedDict([('gzip', compress_gzip)])
+if brotli is not None:
+    ENCODERS['br'] = compress_brotli
+    ENCODERS.move_to_end('br', last=False)
+
+
+def negotiate(accept_encoding):
+    # The preferred encoding that Accept-Encoding accepts, or None for identity.
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    best = None
+    for encoding in ENCODERS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best and best[0]
+
+
+def is_compressible(content_type):
+    if not content_type:
+        return False
+    return content_type.split(';')[0].strip().lower() in settings.compressible_types
+
+
+def encoded_etag(etag, encoding):
+    # A compressed body is a different representation with different bytes, so it gets its
+    # own strong ETag: the page's, suffixed with the encoding, e.g. "<sha1>-gzip".
+    return '%s-%s"' % (etag[:-1], encoding)
+
+
+def identity_etag(etag):
+    # The ETag of the uncompressed body of a representation with ETag `etag`.
+    for encoding in ENCODERS:
+        suffix = '-%s"' % encoding
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+class CompressedBodyCache:
+    # LRU cache of compressed bodies, by ETag and encoding. Only responses with an ETag are
+    # cached, since the ETag identifies the uncompressed body.
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag, encoding, data):
+        body = self.lookup(etag, encoding)
+        if body is None:
+            body = compress(encoding, data)
+            self.add(etag, encoding, body)
+        return body
+
+    def lookup(self, etag, encoding):
+        key = (etag, encoding)
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+        compression_cache_lookups.inc('miss' if body is None else 'hit')
+        return body
+
+    def add(self, etag, encoding, body):
+        with self._lock:
+            self._bodies[(etag, encoding)] = body
+            while len(self._bodies) > self.max_size:
+                self._bodies.popitem(last=False)
+
+
+def compress(encoding, data):
+    start = time.process_time()
+    body = ENCODERS[encoding](data)
+    compression_duration.observe(time.process_time() - start, encoding)
+    compressed_bytes.inc(encoding, 'in', amount=len(data))
+    compressed_bytes.inc(encoding, 'out', amount=len(body))
+    return body
+
+
+class CompressionMiddleware(object):
+    # Compresses text responses (pages, JSON, metrics) of at least compression_min_size
+    # bytes with the best encoding the client accepts. Streamed responses, i.e. recordings
+    # and image files, are sent as they are. Under ASGI, `run_in_thread` runs compression in
+    # the responders' thread pool so that it does not block the event loop.
+
+    def __init__(self, run_in_thread=None):
+        self.cache = CompressedBodyCache(settings.compression_cache_size)
+        self.run_in_thread = run_in_thread
+
+    def process_response(self, request, response, resource, req_succeeded):
+        compressible = self._compressible_body(request, response)
+        if compressible is None:
+            return
+        encoding, etag, data = compressible
+        if etag is not None:
+            body = self.cache.get(etag, encoding, data)
+        else:
+            body = compress(encoding, data)
+        self._set_body(response, encoding, etag, body)
+
+    async def process_response_async(self, request, response, resource, req_succeeded):
+        compressible = self._compressible_body(request, response)
+        if compressible is None:
+            return
+        encoding, etag, data = compressible
+        body = self.cache.lookup(etag, encoding) if etag is not None else None
+        if body is None:
+            if self.run_in_thread is None:
+                body = compress(encoding, data)
+            else:
+                body = await self.run_in_thread(compress, encoding, data)
+            if etag is not None:
+                self.cache.add(etag, encoding, body)
+        self._set_body(response, encoding, etag, body)
+
+    def _compressible_body(self, request, response):
+        # (encoding, ETag, body) of a response to compress, or None.
+        etag = response.get_header('ETag')
+        if response.status[:3] == '304':
+            # A 304 has no Content-Type to tell. The resource compared If-None-Match with the
+            # ETag of the uncompressed body; answer with the ETag of the compressed
+            # representation if that is the one the client holds.
+            encoding = negotiate(request.get_header('Accept-Encoding'))
+            if etag is not None and encoding is not None:
+                if_none_match = request.get_header('If-None-Match') or ''
+                tags = [tag.strip() for tag in if_none_match.split(',')]
+                if encoded_etag(etag, encoding) in tags:
+                    response.append_header('Vary', 'Accept-Encoding')
+                    response.set_header('ETag', encoded_etag(etag, encoding))
+            return None
+        if not is_compressible(response.content_type):
+            return None
+        if response.get_header('Content-Encoding') is not None:
+            return None
+        response.append_header('Vary', 'Accept-Encoding')
+        encoding = negotiate(request.get_header('Accept-Encoding'))
+        if encoding is None:
+            return None
+        if response.text is not None:
+            data = response.text.encode('utf-8')
+        elif response.data is not None:
+            data = response.data
+        else:
+            return None
+        if len(data) < settings.compression_min_size:
+            return None
+        return encoding, etag, data
+
+    def _set_body(self, response, encoding, etag, body):
+        response.data = body
+        response.text = None
+        response.set_header('Content-Encoding', encoding)
+        if etag is not None:
+            response.set_header('ETag', encoded_etag(etag, encoding))
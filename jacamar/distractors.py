@@ -0,0 +1,82 @@
+import math
+import random
+from collections import defaultdict
+
+from jacamar import settings
+
+
+class DistractorIndex:
+    # The most plausible wrong answers for each family and species, best first, so that
+    # picking quiz options is a few random index lookups.
+    #
+    # Families rank other families of the same order first, then by how close their
+    # typical weights are. Species rank species of the same genus first, then of the same
+    # family, then of the families ranked for their family. Only the settings.max_distractors
+    # best are kept.
+    #
+    # The image quiz shows the answer's family, so species options only come from other
+    # families when the family has too few species to fill them.
+
+    def __init__(self, families, species):
+        # `families` maps family ids to (order id, weight); `species` maps species ids to
+        # (genus id, family id), and gives the order species are ranked in within a genus
+        # or family.
+        self.families = {}
+        for family_id, (order_id, weight) in families.items():
+            others = sorted(
+                (other for other in families if other != family_id),
+                key=lambda other: (families[other][0] != order_id,
+                                   abs(math.log(families[other][1] / weight))))
+            self.families[family_id] = others[:settings.max_distractors]
+
+        genus_species = defaultdict(list)
+        family_species = defaultdict(list)
+        for species_id, (genus_id, family_id) in species.items():
+            genus_species[genus_id].append(species_id)
+            family_species[family_id].append(species_id)
+
+        self.species = {}
+        for species_id, (genus_id, family_id) in species.items():
+            ranked = [other for other in genus_species[genus_id] if other != species_id]
+            for other in family_species[family_id]:
+                if len(ranked) >= settings.max_distractors:
+                    break
+                if species[other][0] != genus_id:
+                    ranked.append(other)
+            n_family = min(len(ranked), settings.max_distractors)
+            for other_family_id in self.families.get(family_id, []):
+                if len(ranked) >= settings.max_distractors:
+                    break
+                ranked.extend(family_species[other_family_id])
+            self.species[species_id] = (ranked[:settings.max_distractors], n_family)
+
+    def family_options(self, family_id, n_options, difficulty=None):
+        return options(family_id, self.families.get(family_id, []), n_options, difficulty)
+
+    def species_options(self, species_id, n_options, difficulty=None):
+        ranked, n_family = self.species.get(species_id, ([], 0))
+        if n_family >= n_options - 1:
+            return options(species_id, ranked[:n_family], n_options, difficulty)
+        # The whole family, and the best ranked of other families.
+        return options(species_id, ranked[:n_options - 1], n_options, difficulty)
+
+
+def options(answer, ranked, n_options, difficulty=None):
+    # The answer and n_options - 1 distractors, shuffled. With difficulty 1 the distractors
+    # are the best ranked; with 0 they are drawn from all of `ranked`.
+    if difficulty is None:
+        difficulty = settings.distractor_difficulty
+    k = min(n_options - 1, len(ranked))
+    window = k + round((1 - difficulty) * (len(ranked) - k))
+    result = [answer] + [ranked[i] for i in sample_indexes(window, k)]
+    random.shuffle(result)
+    return result
+
+
+def sample_indexes(n, k):
+    # k distinct indexes below n, in O(k) time and memory (Floyd's algorithm).
+    selected = set()
+    for j in range(n - k, n):
+        i = random.randint(0, j)
+        selected.add(j if i in selected else i)
+    return selected
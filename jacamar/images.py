@@ -0,0 +1,52 @@
+import hashlib
+import os
+
+from jacamar import settings
+
+
+# Leading bytes of the image formats served from the store.
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+
+def image_path(digest):
+    # Images are stored by the SHA-256 of their bytes, fanned out over 256 directories.
+    return os.path.join(settings.image_store_dir, digest[:2], digest)
+
+
+def store_image(data):
+    digest = hashlib.sha256(data).hexdigest()
+    path = image_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def is_digest(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def image_content_type(path):
+    with open(path, 'rb') as fp:
+        head = fp.read(16)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return 'application/octet-stream'
+
+
+def image_src(url, digest):
+    # URL to show an image at: the local copy if there is one, else the remote original.
+    if digest and os.path.exists(image_path(digest)):
+        return '/image-files/%s' % digest
+    return url
@@ -0,0 +1,106 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
+from jacamar import metrics
+from jacamar import settings
+
+
+# Attributes every LogRecord has; anything else was passed in `extra` and is logged as a
+# field of the record.
+RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+records_dropped = metrics.Counter(
+    'jacamar_log_records_dropped_total', 'Log records dropped because the queue was full.', [])
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, e.g.
+    # {"time": "...", "level": "INFO", "logger": "jacamar.resources", "message": "...", ...}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps a random `rate` fraction of records below WARNING, and every other record.
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # Hands records to the listener thread, dropping them rather than blocking the request
+    # when the queue is full. Formatting is left to the listener.
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            records_dropped.inc()
+
+
+_configured = False
+_lock = threading.Lock()
+
+
+def configure():
+    # Routes the `jacamar` loggers through a bounded queue to a thread that writes JSON
+    # lines to stderr. Only the first call does so, since both jacamar.app and jacamar.asgi
+    # call it and a process may import both.
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+
+    handler = NonBlockingQueueHandler(queue.Queue(settings.log_queue_size))
+    handler.addFilter(SamplingFilter(settings.log_sample_rate))
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(handler.queue, stream_handler)
+
+    logger = logging.getLogger('jacamar')
+    logger.setLevel(settings.log_level)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    def restart_in_child():
+        # The listener thread does not survive a fork (e.g. gunicorn --preload).
+        handler.queue = listener.queue = queue.Queue(settings.log_queue_size)
+        listener.start()
+
+    listener.start()
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=restart_in_child)
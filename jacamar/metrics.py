@@ -0,0 +1,269 @@
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache
+
+from jacamar import settings
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+registry = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        registry[name] = self
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram(Counter):
+    # Values are per-bucket (not cumulative) counts, the last bucket being +Inf, followed
+    # by the sum of all observations.
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames, buckets):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def samples(self, labels, value):
+        cumulative = 0
+        for le, count in zip(self.buckets + ['+Inf'], value[:-1]):
+            cumulative += count
+            yield self.name + '_bucket', labels + (('le', str(le)),), cumulative
+        yield self.name + '_sum', labels, value[-1]
+        yield self.name + '_count', labels, cumulative
+
+
+request_duration = Histogram(
+    'jacamar_http_request_duration_seconds', 'Time spent handling requests.',
+    ['method', 'route'], DURATION_BUCKETS)
+requests_total = Counter(
+    'jacamar_http_requests_total', 'Requests handled, by response status.',
+    ['method', 'route', 'status'])
+request_errors = Counter(
+    'jacamar_http_request_errors_total',
+    'Requests that raised an unhandled exception or returned a 5xx status.',
+    ['method', 'route'])
+response_size = Histogram(
+    'jacamar_http_response_size_bytes', 'Size of response bodies.',
+    ['method', 'route'], SIZE_BUCKETS)
+db_query_duration = Histogram(
+    'jacamar_db_query_duration_seconds',
+    'Time spent in SQLite, by query shape and step (execute or fetch).',
+    ['query', 'step'], DURATION_BUCKETS)
+template_render_duration = Histogram(
+    'jacamar_template_render_duration_seconds', 'Time spent rendering Jinja templates.',
+    ['template'], DURATION_BUCKETS)
+page_cache_lookups = Counter(
+    'jacamar_page_cache_lookups_total', 'Rendered page cache lookups, by result.',
+    ['result'])
+
+
+@contextmanager
+def timer(histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+
+@lru_cache(maxsize=1024)
+def query_shape(query):
+    # The query with literals replaced by ? and whitespace collapsed, so that queries built
+    # with f-strings are grouped with their other instances.
+    query = re.sub(r"'(?:[^']|'')*'", '?', query)
+    query = re.sub(r'\b\d+(?:\.\d+)?\b', '?', query)
+    return ' '.join(query.split())
+
+
+# Aggregation across worker processes: a background thread in each worker writes its own
+# metrics to <metrics_dir>/<pid>.json every metrics_flush_interval seconds, so that requests
+# never wait on the file system, and /metrics sums the files of all workers, past and
+# present, so counters never go backwards when a worker is replaced. The directory should
+# be emptied when the server starts.
+
+_flush_lock = threading.Lock()
+_flusher_lock = threading.Lock()
+_flusher_started = False
+
+
+def worker_file():
+    return os.path.join(settings.metrics_dir, '%d.json' % os.getpid())
+
+
+def snapshot():
+    with _lock:
+        return {name: [[list(labels), value] for labels, value in metric.values.items()]
+                for name, metric in registry.items()}
+
+
+def flush():
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        path = worker_file()
+        os.makedirs(settings.metrics_dir, exist_ok=True)
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(snapshot(), fp)
+        os.replace(path + '.tmp', path)
+    finally:
+        _flush_lock.release()
+
+
+def start_flusher():
+    # Starts the flushing thread of this process, once, and again in each forked child
+    # (e.g. gunicorn --preload), which does not inherit it.
+    global _flusher_started
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+    run_flusher()
+    atexit.register(flush)
+    os.register_at_fork(after_in_child=run_flusher)
+
+
+def run_flusher():
+    def flush_periodically():
+        while True:
+            time.sleep(settings.metrics_flush_interval)
+            flush()
+
+    threading.Thread(target=flush_periodically, name='jacamar-metrics', daemon=True).start()
+
+
+def collect():
+    # All workers' metrics in the Prometheus text format: this worker's from memory, the
+    # others' from their files.
+    merged = {name: {} for name in registry}
+    workers_metrics = [snapshot()]
+    own_file = worker_file()
+    for path in glob.glob(os.path.join(settings.metrics_dir, '*.json')):
+        if path == own_file:
+            continue
+        try:
+            with open(path) as fp:
+                workers_metrics.append(json.load(fp))
+        except (OSError, ValueError):
+            continue
+    for worker_metrics in workers_metrics:
+        for name, values in worker_metrics.items():
+            metric = registry.get(name)
+            if metric is None:
+                continue
+            for labels, value in values:
+                labels = tuple(labels)
+                previous = merged[name].get(labels)
+                merged[name][labels] = value if previous is None else metric.merge(previous, value)
+    return render(merged)
+
+
+def render(merged):
+    lines = []
+    for name, metric in registry.items():
+        lines.append('# HELP %s %s' % (name, metric.help))
+        lines.append('# TYPE %s %s' % (name, metric.type))
+        for labels, value in sorted(merged[name].items()):
+            for sample_name, sample_labels, sample_value in metric.samples(
+                    tuple(zip(metric.labelnames, labels)), value):
+                lines.append('%s%s %s' % (sample_name, format_labels(sample_labels),
+                                          format_value(sample_value)))
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape_label(value)) for name, value in labels)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def response_size_of(request, response):
+    if request.method == 'HEAD' or response.status[:3] in ('204', '304'):
+        return 0
+    if response.text is not None:
+        return len(response.text.encode('utf-8'))
+    if response.data is not None:
+        return len(response.data)
+    return int(response.content_length or 0)
+
+
+class MetricsMiddleware(object):
+    # Records latency, status and response size per route template, e.g.
+    # "/recordings/{recording_id:int}", so that label values stay bounded.
+
+    def __init__(self):
+        start_flusher()
+
+    def process_request(self, request, response):
+        request.context.metrics_start = time.perf_counter()
+
+    def process_response(self, request, response, resource, req_succeeded):
+        elapsed = time.perf_counter() - request.context.metrics_start
+        route = request.uri_template or 'unmatched'
+        status = response.status[:3]
+        if not req_succeeded and status < '400':
+            # An unhandled exception, which the server turns into a 500.
+            status = '500'
+
+        request_duration.observe(elapsed, request.method, route)
+        requests_total.inc(request.method, route, status)
+        if status >= '500':
+            request_errors.inc(request.method, route)
+        response_size.observe(response_size_of(request, response), request.method, route)
+
+    # The same, for jacamar.asgi.
+
+    async def process_request_async(self, request, response):
+        self.process_request(request, response)
+
+    async def process_response_async(self, request, response, resource, req_succeeded):
+        self.process_response(request, response, resource, req_succeeded)
@@ -0,0 +1,154 @@
+import math
+import os
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+from jacamar import settings
+
+
+# Bit rates in kbit/s by bitrate index, for (MPEG version 1, layer) and (MPEG 2/2.5, layer).
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates by the header's version bits (0: MPEG 2.5, 2: MPEG 2, 3: MPEG 1).
+SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+FrameHeader = namedtuple('FrameHeader', ['length', 'samples', 'sample_rate', 'bitrate'])
+# Sizes in bytes, durations in seconds, bit rates in bit/s.
+Metadata = namedtuple('Metadata', ['size', 'duration', 'bitrate', 'sample_rate', 'frame_count'])
+
+
+def parse_frame_header(header):
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x3
+    layer = 4 - ((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    padding = (header[2] >> 1) & 0x1
+    if (version_bits == 1 or layer == 4 or bitrate_index in (0, 15)
+            or sample_rate_index == 3):
+        return None
+
+    version = 1 if version_bits == 3 else 2
+    bitrate = BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and version == 2 else 1152
+        length = samples // 8 * bitrate // sample_rate + padding
+    return FrameHeader(length, samples, sample_rate, bitrate)
+
+
+def id3v2_size(data):
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def is_vbr_info_frame(frame):
+    # The Xing/Info or VBRI frame written by encoders holds no audio, and describes the
+    # whole file; it must not be copied into a clip.
+    return b'Xing' in frame[:64] or b'Info' in frame[:64] or frame[36:40] == b'VBRI'
+
+
+class Frames(namedtuple('Frames', ['offsets', 'sample_rate', 'samples_per_frame'])):
+    # Byte offsets of the audio frames of a file; offsets[-1] is the end of the last frame.
+
+    @property
+    def count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def duration(self):
+        return self.count * self.samples_per_frame / self.sample_rate
+
+    @property
+    def bitrate(self):
+        # Average over the audio frames, so also right for VBR files.
+        if not self.count:
+            return 0
+        return round((self.offsets[-1] - self.offsets[0]) * 8 / self.duration)
+
+    def window(self, start, duration=None):
+        # (offset, length) of the whole frames covering [start, start + duration) seconds,
+        # or None if that is past the end of the audio.
+        frames_per_second = self.sample_rate / self.samples_per_frame
+        # Compared before rounding, since a large enough start or duration overflows.
+        first = max(start * frames_per_second, 0)
+        if first >= self.count:
+            return None
+        first = int(first)
+        last = self.count
+        if duration is not None and (start + duration) * frames_per_second < last:
+            last = math.ceil((start + duration) * frames_per_second)
+        if first >= last:
+            return None
+        return self.offsets[first], self.offsets[last] - self.offsets[first]
+
+
+def scan_frames(data):
+    offset = id3v2_size(data)
+    end = len(data)
+    if data[end - 128:end - 125] == b'TAG':
+        end -= 128
+
+    offsets = array('Q')
+    sample_rate = samples_per_frame = None
+    frame_end = offset
+    while offset + 4 <= end:
+        header = parse_frame_header(data[offset:offset + 4])
+        if (header is None or offset + header.length > end
+                or sample_rate not in (None, header.sample_rate)):
+            # Not a frame (or a truncated one): resynchronize on the next candidate.
+            offset = data.find(b'\xff', offset + 1, end)
+            if offset < 0:
+                break
+            continue
+        if sample_rate is None:
+            sample_rate, samples_per_frame = header.sample_rate, header.samples
+            if is_vbr_info_frame(data[offset:offset + header.length]):
+                offset = frame_end = offset + header.length
+                continue
+        offsets.append(offset)
+        offset = frame_end = offset + header.length
+
+    if sample_rate is None:
+        raise ValueError('No MPEG audio frames found')
+    offsets.append(frame_end)
+    return Frames(offsets, sample_rate, samples_per_frame)
+
+
+def read_frames(path):
+    stat = os.stat(path)
+    return _read_frames(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=settings.mp3_frame_cache_size)
+def _read_frames(path, mtime_ns, size):
+    with open(path, 'rb') as fp:
+        return scan_frames(fp.read())
+
+
+def read_metadata(path):
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    frames = scan_frames(data)
+    return Metadata(len(data), frames.duration, frames.bitrate, frames.sample_rate, frames.count)
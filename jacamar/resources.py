@@ -1,62 +1,541 @@
+import hashlib
+import json
+import logging
+import math
 import os
+import random
 import sqlite3
+import threading
+from collections import OrderedDict
 from collections import defaultdict
+from datetime import datetime
+from urllib.parse import parse_qsl
+from urllib.parse import quote
 
 import falcon
 import jinja2
 
+from jacamar import compression
+from jacamar import distractors
+from jacamar import images
+from jacamar import metrics
+from jacamar import mp3
 from jacamar import settings
+from jacamar import snapshot
+from jacamar import tokens
+
+
+logger = logging.getLogger(__name__)
+
+os.makedirs(settings.template_cache_dir, exist_ok=True)
+
+
+class TimedTemplate(jinja2.Template):
+
+    def render(self, *args, **kwargs):
+        with metrics.timer(metrics.template_render_duration, self.name):
+            return super().render(*args, **kwargs)
+
+
+template_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(settings.template_dir),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(settings.template_cache_dir),
+    auto_reload=settings.template_auto_reload,
+)
+template_env.template_class = TimedTemplate
+template_env.globals['image_src'] = images.image_src
 
 
 def load_template(name):
-    path = os.path.join(settings.template_dir, name)
-    with open(os.path.abspath(path), 'r') as fp:
-        return jinja2.Template(fp.read())
+    # Compiled once per worker; with auto_reload the loader only recompiles when the
+    # file's mtime changes, and new workers load the compiled bytecode from disk.
+    return template_env.get_template(name)
+
+
+class FileRange:
+    # Stream `length` bytes of an open file from its current position.
+
+    def __init__(self, fp, length):
+        self.fp = fp
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+def strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def is_not_modified(request, etag, last_modified=None):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if_none_match = request.get_header('If-None-Match')
+    if if_none_match is not None:
+        # Weak comparison, as If-None-Match requires, against the ETag of the uncompressed
+        # body: CompressionMiddleware gives compressed bodies their own ETags.
+        tags = [compression.identity_etag(t.strip()) for t in if_none_match.split(',')]
+        return '*' in tags or strip_weak(etag) in [strip_weak(t) for t in tags]
+    if_modified_since = request.if_modified_since
+    return (last_modified is not None and if_modified_since is not None
+            and last_modified <= if_modified_since)
+
+
+def set_file_response(request, response, path, content_type, window=None):
+    # `window` is the (offset, length) of the part of the file to serve, if not all of it;
+    # byte ranges are then relative to the window.
+    stat = os.stat(path)
+    if window is None:
+        offset, size = 0, stat.st_size
+        etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+    else:
+        offset, size = window
+        etag = '"%x-%x-%x-%x"' % (stat.st_mtime_ns, stat.st_size, offset, size)
+    last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+
+    response.set_header('ETag', etag)
+    response.last_modified = last_modified
+
+    if is_not_modified(request, etag, last_modified):
+        response.status = falcon.HTTP_304
+        return
+
+    start, end = 0, size - 1
+    byte_range = request.range
+    if_range = request.get_header('If-Range')
+    # If-Range uses strong comparison: a weak validator never matches.
+    if byte_range is not None and (if_range is None or
+                                   (not if_range.startswith('W/') and if_range == etag)):
+        first, last = byte_range
+        if first < 0:
+            start = max(size + first, 0)
+        else:
+            start = first
+            if 0 <= last < end:
+                end = last
+        if start > end:
+            raise falcon.HTTPRangeNotSatisfiable(size)
+        response.status = falcon.HTTP_206
+        response.content_range = (start, end, size)
+    else:
+        response.status = falcon.HTTP_200
+
+    # Not on a 304, which must not describe a body.
+    response.content_type = content_type
+    response.accept_ranges = 'bytes'
+    length = end - start + 1
+    if request.method == 'HEAD':
+        response.content_length = length
+        return
+
+    fp = open(path, 'rb')
+    if offset + start == 0 and end == stat.st_size - 1:
+        # Whole file: let the server use wsgi.file_wrapper/sendfile.
+        response.set_stream(fp, stat.st_size)
+    else:
+        fp.seek(offset + start)
+        response.set_stream(FileRange(fp, length), length)
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Records the time spent executing each query and fetching its rows, by query shape.
+
+    def execute(self, query, parameters=()):
+        self.shape = metrics.query_shape(query)
+        with metrics.timer(metrics.db_query_duration, self.shape, 'execute'):
+            return super().execute(query, parameters)
+
+    def fetchone(self):
+        with metrics.timer(metrics.db_query_duration, self.shape, 'fetch'):
+            return super().fetchone()
+
+    def fetchall(self):
+        with metrics.timer(metrics.db_query_duration, self.shape, 'fetch'):
+            return super().fetchall()
 
 
 class Database:
+    # One read-only connection per thread, opened lazily. Connections inherited across a
+    # fork are dropped so that each worker opens its own. `make db` copies a fresh build in
+    # as an ordinary transaction; a connection is still reopened if the file is replaced.
+
+    def __init__(self, path=None):
+        self.path = path or settings.db_file
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._build_id = None
+
+    @property
+    def connection(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = threading.local()
+        inode = os.stat(self.path).st_ino
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.inode != inode:
+            if connection is not None:
+                connection.close()
+            connection = self._local.connection = self.connect()
+            self._local.inode = inode
+        return connection
+
+    def connect(self):
+        uri = 'file:%s?mode=ro' % quote(self.path)
+        if settings.db_immutable:
+            uri += '&immutable=1'
+        connection = sqlite3.connect(uri, uri=True)
+        connection.row_factory = sqlite3.Row
+        connection.execute('pragma mmap_size = %d' % settings.db_mmap_size)
+        return connection
+
+    def execute(self, query, parameters=()):
+        return self.connection.cursor(TimedCursor).execute(query, parameters)
+
+    def version(self):
+        # Changes when the database file is replaced or a transaction is committed to it.
+        version = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            version.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(version)
+
+    def build_id(self):
+        # The build recorded in the manifest that bin/load_tables.sql and bin/update_db.py
+        # keep in the database, or None if it has none; see jacamar/snapshot.py.
+        if self._build_id is None:
+            self._build_id = DatabaseCache(self, self._read_build_id)
+        return self._build_id.get()
+
+    def _read_build_id(self):
+        try:
+            row = self.execute('select manifest from build').fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return json.loads(row[0]).get('build_id') if row and row[0] else None
 
-    def __init__(self):
-        self.connection = sqlite3.connect(settings.db_file)
-        self.connection.row_factory = sqlite3.Row
 
-    def execute(self, query):
-        return self.connection.cursor().execute(query)
+database = Database()
 
 
-class BaseResource(object):
+class DatabaseCache:
+    # A value derived from the database, built on first use and rebuilt whenever the
+    # database changes.
 
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, db, build):
+        self.db = db
+        self.build = build
+        self._version = None
+        self._value = None
 
+    def get(self):
+        version = self.db.version()
+        if version != self._version:
+            self._value = self.build()
+            self._version = version
+        return self._value
 
-class Image(BaseResource):
 
-    def on_get(self, request, response, family_id=None):
-        cursor = self.db.connection.cursor()
+class QuizIndex(DatabaseCache):
+    # IDs eligible as quiz questions, so that picking a question is a random index lookup
+    # followed by a primary key fetch.
+
+    def __init__(self, db, query, parameters=()):
+        super().__init__(db, lambda: [id for id, in db.execute(query, parameters).fetchall()])
+
+    def choice(self):
+        return random.choice(self.get())
+
+    def sample(self, k):
+        # Up to k distinct IDs.
+        ids = self.get()
+        return random.sample(ids, min(k, len(ids)))
+
+
+class QuizSpecies(DatabaseCache):
+    # The species and families that quizzes are drawn from, with the species' quiz
+    # recordings, and their distractor index, so that picking options needs no query.
 
+    def __init__(self, db):
+        super().__init__(db, self._build)
+
+    def _build(self):
+        condition, parameters = quiz_filter()
         query = f"""
-        select family.name, family.english_name from family where family.id = {family_id}
+        select taxon.species_id, taxon.genus_id, taxon.family_id, taxon.order_id,
+               taxon.family_weight, taxon.family_name, taxon.family_english_name,
+               taxon.genus_name, taxon.species_name, taxon.species_english_name,
+               recording.id as recording_id
+        from taxon join recording on recording.species_id = taxon.species_id
+        where {condition}
+        order by taxon.family_id, taxon.genus_name, taxon.species_name, recording.id
+        """
+        families = OrderedDict()
+        species = OrderedDict()
+        for row in self.db.execute(query, parameters).fetchall():
+            if row['family_id'] not in families:
+                families[row['family_id']] = {
+                    'family_id': row['family_id'],
+                    'name': row['family_name'],
+                    'english_name': row['family_english_name'],
+                    'order_id': row['order_id'],
+                    'weight': row['family_weight'],
+                }
+            if row['species_id'] not in species:
+                species[row['species_id']] = {
+                    'species_id': row['species_id'],
+                    'genus_id': row['genus_id'],
+                    'family_id': row['family_id'],
+                    'name': '%s (%s %s)' % (row['species_english_name'], row['genus_name'],
+                                            row['species_name']),
+                    'recording_ids': [],
+                }
+            species[row['species_id']]['recording_ids'].append(row['recording_id'])
+        index = distractors.DistractorIndex(
+            {id: (family['order_id'], family['weight']) for id, family in families.items()},
+            {id: (s['genus_id'], s['family_id']) for id, s in species.items()})
+        return index, families, species
+
+    def options(self, species_id, n_options):
+        # {name: {'species_id', 'recording_ids'}} of the species and n_options - 1
+        # distractors, in random order.
+        index, _, species = self.get()
+        options = OrderedDict()
+        for id in index.species_options(species_id, n_options):
+            if id in species:
+                options[species[id]['name']] = {
+                    'species_id': id,
+                    'recording_ids': species[id]['recording_ids'],
+                }
+        return options
+
+    def family_options(self, family_id, n_options):
+        index, families, _ = self.get()
+        return [families[id] for id in index.family_options(family_id, n_options)
+                if id in families]
+
+
+def quiz_filter():
+    # SQL condition over `recording` and `taxon`, and its parameters, selecting the
+    # recordings that quizzes are drawn from.
+    kinds = ', '.join(['?'] * len(settings.quiz_recording_kinds))
+    families = ', '.join(['?'] * len(settings.quiz_excluded_families))
+    condition = f'recording.kind in ({kinds}) and not taxon.family_name in ({families})'
+    parameters = list(settings.quiz_recording_kinds) + list(settings.quiz_excluded_families)
+    if settings.quiz_min_duration is not None:
+        condition += ' and (recording.duration is null or recording.duration >= ?)'
+        parameters.append(settings.quiz_min_duration)
+    if settings.quiz_max_duration is not None:
+        condition += ' and (recording.duration is null or recording.duration <= ?)'
+        parameters.append(settings.quiz_max_duration)
+    return condition, parameters
+
+
+class FamilyCatalogue(DatabaseCache):
+    # The families that recording quiz questions are drawn from, by weight, with all their
+    # images.
+
+    def __init__(self, db):
+        super().__init__(db, self._build)
+
+    def _build(self):
+        condition, parameters = quiz_filter()
+        family_query = f"""
+        select distinct taxon.family_id as id, taxon.family_name as name,
+               taxon.family_english_name as english_name, taxon.family_weight as weight
+        from recording join taxon on taxon.species_id = recording.species_id
+        where {condition}
+        order by taxon.family_weight
         """
-        family_name, family_english_name = cursor.execute(query).fetchone()
+        families = self.db.execute(family_query, parameters).fetchall()
 
-        query = f"""
-        select genus.name, species.name, species.english_name, image.url from image
-        inner join species on image.species_id = species.id
-        inner join genus on species.genus_id = genus.id
-        inner join family on genus.family_id = family.id
-        where family.id={family_id}
-        order by genus.name, species.name
+        image_query = """
+        select taxon.family_name, image.url, image.sha256
+        from image
+        join taxon on taxon.species_id = image.species_id
         """
-        images = list(cursor.execute(query).fetchall())
+        image_rows = self.db.execute(image_query).fetchall()
+        family2images = defaultdict(list)
+        for family, url, sha256 in image_rows:
+            family2images[family].append((url, sha256))
+
+        families = list(map(dict, families))
+
+        for family in families:
+            family['images'] = family2images[family['name']]
 
-        template_path = os.path.join(settings.template_dir, 'images.html')
+        return families
+
+
+class QuizCaches:
+    # The question indexes and catalogues of the quizzes over one database, shared by the
+    # HTML and API resources so that each worker builds them once per database version.
+
+    def __init__(self, db):
+        condition, parameters = quiz_filter()
+        self.recording_index = QuizIndex(db, f"""
+        select recording.id
+        from recording
+        inner join taxon on taxon.species_id = recording.species_id
+        where {condition}
+        and taxon.image_id is not null
+        """, parameters)
+        self.image_index = QuizIndex(db, f"""
+        select image.id
+        from image
+        inner join taxon on taxon.species_id = image.species_id
+        where exists (select 1 from recording
+                      where recording.species_id = taxon.species_id and {condition})
+        """, parameters)
+        self.family_catalogue = FamilyCatalogue(db)
+        self.quiz_species = QuizSpecies(db)
+
+
+quiz_caches = QuizCaches(database)
+
+
+def get_quiz_caches(db):
+    return quiz_caches if db is database else QuizCaches(db)
+
+
+class PageCache:
+    # LRU cache of rendered pages and their ETags, emptied whenever the database changes.
+
+    def __init__(self, db, max_size):
+        self.db = db
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        version = self.db.version()
+        with self._lock:
+            if version != self._version:
+                self._pages.clear()
+                self._version = version
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                metrics.page_cache_lookups.inc('hit')
+                return page, True
+            self.misses += 1
+            metrics.page_cache_lookups.inc('miss')
+
+        body = render()
+        page = (body, '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest())
+        with self._lock:
+            if version == self._version:
+                self._pages[key] = page
+                while len(self._pages) > self.max_size:
+                    self._pages.popitem(last=False)
+        return page, False
+
+
+page_cache = PageCache(database, settings.page_cache_size)
+
+
+def set_cached_page(request, response, key, render):
+    (body, etag), hit = page_cache.get(key, render)
+    response.set_header('ETag', etag)
+    response.set_header('X-Cache', 'hit' if hit else 'miss')
+    response.cache_control = settings.page_cache_control
+    if is_not_modified(request, etag):
+        response.status = falcon.HTTP_304
+    else:
         response.status = falcon.HTTP_200
         response.content_type = falcon.MEDIA_HTML
-        response.body = (load_template(template_path)
-                         .render(family_name=family_name,
-                                 family_english_name=family_english_name,
-                                 images=images))
+        response.text = body
+
+
+class Metrics(object):
+
+    def on_get(self, request, response):
+        response.text = metrics.collect()
+        response.content_type = metrics.CONTENT_TYPE
+        response.status = falcon.HTTP_200
+
+
+class BaseResource(object):
+
+    def __init__(self, db=None):
+        self.db = db or database
+
+    def get_recording_classification(self, recording_id):
+        query = """
+        select recording.id, recording.species_id, taxon.family_id
+        from recording
+        inner join taxon on taxon.species_id = recording.species_id
+        where recording.id = ?
+        """
+        recording = self.db.execute(query, (recording_id,)).fetchone()
+        if recording is None:
+            raise falcon.HTTPNotFound()
+        return recording
+
+    def check_recording_answer(self, form_data, field):
+        # Whether form_data[field] ('family_id' or 'species_id') is right for the recording,
+        # from the answer token if it can tell, else from the database.
+        correct = tokens.check(form_data.get('token'), 'recording', form_data['recording_id'],
+                               field, form_data[field])
+        if correct is None:
+            recording = self.get_recording_classification(form_data['recording_id'])
+            correct = form_data[field] == recording[field]
+        return correct
+
+
+class Image(BaseResource):
+
+    def on_get(self, request, response, family_id=None):
+        set_cached_page(request, response, ('images', family_id),
+                        lambda: self._render(family_id))
+
+    def _render(self, family_id):
+        query = """
+        select family.name, family.english_name from family where family.id = ?
+        """
+        family = self.db.execute(query, (family_id,)).fetchone()
+        if family is None:
+            raise falcon.HTTPNotFound()
+        family_name, family_english_name = family
+
+        query = """
+        select taxon.genus_name, taxon.species_name, taxon.species_english_name, image.url, image.sha256
+        from taxon
+        inner join image on image.species_id = taxon.species_id
+        where taxon.family_id = ?
+        order by taxon.genus_name, taxon.species_name
+        """
+        images = list(self.db.execute(query, (family_id,)).fetchall())
+        return (load_template('images.html')
+                .render(family_name=family_name,
+                        family_english_name=family_english_name,
+                        images=images))
+
+
+class ImageFile(BaseResource):
+
+    def on_get(self, request, response, digest):
+        # Content-addressed, so a stored image never changes.
+        if not images.is_digest(digest) or not os.path.exists(images.image_path(digest)):
+            raise falcon.HTTPNotFound()
+        path = images.image_path(digest)
+        set_file_response(request, response, path, images.image_content_type(path))
+        response.cache_control = settings.image_cache_control
+
+    on_head = on_get
 
 
 class Recording(BaseResource):
@@ -72,77 +551,116 @@ class Recording(BaseResource):
             else:
                 species['recordings'] = [recording]
             species['image_url'] = el['url']
+            species['image_sha256'] = el['sha256']
             species['english_name'] = el['english_name']
             species['name'] = '%s %s' % (el['genus'], el['species'])
             species['id'] = el['species_id']
         return grouped_results
 
-    def on_get(self, request, response, family_id=None, recording_id=None, **_):
+    def on_get(self, request, response, family_id=None, recording_id=None, token=None, **_):
         if family_id is None and recording_id is not None:
             # REST-style request for a recording file
-            query = f"""
-            select path from recording where id = {recording_id}
-            """
-            [recording_path] = self.db.connection.cursor().execute(query).fetchone()
-            with open(recording_path, 'rb') as fp:
-                response.body = fp.read()
+            recording_path = self.get_recording_path(recording_id)
+            window = self._get_clip_window(request, recording_path)
+            set_file_response(request, response, recording_path, 'audio/mpeg', window)
+        elif token:
+            # Second stage of the recording quiz, carrying the question's answer token
+            response.text = self._render_list(family_id, recording_id, token)
+            response.content_type = falcon.MEDIA_HTML
+            response.status = falcon.HTTP_200
         else:
             # Species recordings list view
-            where = []
-            if family_id is not None:
-                where.append(f'family.id = {family_id}')
-            if recording_id is not None:
-                where.append(f'not recording.id = {recording_id}')
-            if where:
-                where_clause = 'where ' + ' and '.join(where)
-            else:
-                where_clause = ''
-            query = f"""
-            select family.name as family, family.english_name as family_english_name, family.weight,
-                   genus.name as genus,
-                   species.name as species, species.english_name as english_name, species.id as species_id,
-                   recording.id, recording.type,
-                   image.url
-            from species
-            inner join image on species.id = image.species_id
-            inner join recording on recording.species_id = species.id
-            inner join genus on species.genus_id = genus.id
-            inner join family on genus.family_id = family.id
-            {where_clause}
-            order by family.weight, genus.name, species.name
-            """
-            query_results = self.db.connection.cursor().execute(query).fetchall()
-            template_path = os.path.join(settings.template_dir, 'recordings.html')
-            response.body = (load_template(template_path)
-                             .render(results=self._group_recording_by_species(query_results),
-                                     recording={'id': recording_id} if recording_id else None))
-
-        response.content_type = falcon.MEDIA_HTML
-        response.status = falcon.HTTP_200
-
-    def on_post(self, request, response):
-        form_data = parse_form_data(request)
-
+            set_cached_page(request, response, ('recordings', family_id, recording_id),
+                            lambda: self._render_list(family_id, recording_id))
+
+    on_head = on_get
+
+    def get_recording_path(self, recording_id):
+        # From the snapshot, without a query, unless there is none of the database's build
+        # or the recording is not in it.
+        taxonomy = snapshot.load(self.db.build_id())
+        recording = taxonomy is not None and taxonomy.recording(recording_id)
+        if recording:
+            return recording.path
+        query = """
+        select path from recording where id = ?
+        """
+        row = self.db.execute(query, [recording_id]).fetchone()
+        if row is None:
+            raise falcon.HTTPNotFound()
+        return row[0]
+
+    def _get_clip_window(self, request, recording_path):
+        # ?start=&duration= (in seconds) selects a clip made of whole MPEG frames, cut
+        # without re-encoding.
+        start = request.get_param('start')
+        duration = request.get_param('duration')
+        if start is None and duration is None:
+            return None
+        try:
+            start = float(start or 0)
+            duration = float(duration) if duration is not None else None
+        except ValueError:
+            raise falcon.HTTPBadRequest(title='Invalid clip',
+                                        description='start and duration must be numbers')
+        if not math.isfinite(start) or (duration is not None and not math.isfinite(duration)):
+            raise falcon.HTTPBadRequest(title='Invalid clip',
+                                        description='start and duration must be finite')
+        if start < 0 or (duration is not None and duration <= 0):
+            raise falcon.HTTPBadRequest(title='Invalid clip',
+                                        description='start and duration must be positive')
+        try:
+            frames = mp3.read_frames(recording_path)
+        except ValueError:
+            logger.warning('recording has no MPEG audio frames', extra={'path': recording_path})
+            raise falcon.HTTPBadRequest(title='Invalid clip',
+                                        description='the recording cannot be cut into clips')
+        window = frames.window(start, duration)
+        if window is None:
+            raise falcon.HTTPBadRequest(title='Invalid clip',
+                                        description='start is past the end of the recording')
+        return window
+
+    def _render_list(self, family_id, recording_id, token=None):
+        where = []
+        parameters = []
+        if family_id is not None:
+            where.append('taxon.family_id = ?')
+            parameters.append(family_id)
+        if recording_id is not None:
+            where.append('not recording.id = ?')
+            parameters.append(recording_id)
+        where.append('taxon.image_id is not null')
+        where_clause = 'where ' + ' and '.join(where)
         query = f"""
-        select recording.id, recording.species_id, family.id as family_id
-        from recording
-        inner join species on species.id = recording.species_id
-        inner join genus on genus.id = species.genus_id
-        inner join family on family.id = genus.family_id
-        where recording.id = {form_data['recording_id']}
+        select taxon.family_name as family, taxon.family_english_name, taxon.family_weight as weight,
+               taxon.genus_name as genus,
+               taxon.species_name as species, taxon.species_english_name as english_name,
+               taxon.species_id, recording.id, recording.type,
+               taxon.image_url as url, taxon.image_sha256 as sha256
+        from taxon
+        inner join recording on recording.species_id = taxon.species_id
+        {where_clause}
+        order by taxon.family_weight, taxon.genus_name, taxon.species_name
         """
-        recording = dict(self.db.execute(query).fetchone())
-        recording['species_id'] = int(recording['species_id'])
-        recording['family_id'] = int(recording['family_id'])
+        query_results = self.db.execute(query, parameters).fetchall()
+        return (load_template('recordings.html')
+                .render(results=self._group_recording_by_species(query_results),
+                        recording={'id': recording_id, 'token': token} if recording_id else None))
+
+    def on_post(self, request, response):
+        form_data = parse_form_data(request, ['species_id', 'recording_id'], ['token'])
 
-        if form_data['species_id'] == recording['species_id']:
-            response.body = "🐦 Success! 🐦"
+        if self.check_recording_answer(form_data, 'species_id'):
+            response.text = "🐦 Success! 🐦"
             response.content_type = falcon.MEDIA_HTML
             response.status = falcon.HTTP_200
         else:
+            recording = self.get_recording_classification(form_data['recording_id'])
             self.on_get(request, response,
                         recording_id=recording['id'],
-                        family_id=recording['family_id'])
+                        family_id=recording['family_id'],
+                        token=form_data.get('token'))
 
 
 class Classification(BaseResource):
@@ -156,7 +674,7 @@ class Classification(BaseResource):
             family_id, genus_id, species_id = self.db.get_classification_by_recording(recording_id)
             classification_id = self.db.get_classification_by_name(classification_name, self.level)
         except Exception as ex:
-            response.context['result'] = 'error'
+            response.context.result = 'error'
         else:
             classifications = {
                 'family': family_id,
@@ -173,10 +691,16 @@ class Family(Classification):
 
     def __init__(self):
         super().__init__(classification_level='family')
+        self.quiz_species = get_quiz_caches(self.db).quiz_species
 
-    def on_get(self, request, recording_id):
-        family_id, genus_id, species_id = self.db.get_classification_by_recording(recording_id)
-        other_families = self.db.get_random_families(settings.n_options)
+    def on_get(self, request, response, recording_id):
+        recording = self.get_recording_classification(recording_id)
+        families = self.quiz_species.family_options(recording['family_id'], settings.n_options)
+        set_json(response, {
+            'recording_id': recording['id'],
+            'options': [{key: family[key] for key in ('family_id', 'name', 'english_name')}
+                        for family in families],
+        })
 
 
 class Genus(Classification):
@@ -191,211 +715,382 @@ class Species(Classification):
 
 class RecordingQuiz(BaseResource):
 
-    def get_families_with_songs(self):
-        family_query = """
-        select distinct family.id, family.name, family.english_name, family.weight
-        from recording join species on species.id = recording.species_id
-        join genus on genus.id = species.genus_id
-        join family on family.id = genus.family_id
-        where recording.type like '%song%'
-        and not family.name in ('Hirundinidae')
-        order by family.weight
-        """
-        families = self.db.connection.cursor().execute(family_query).fetchall()
-
-        image_query = """
-        select family.name, image.url
-        from image
-        join species on species.id = image.species_id
-        join genus on genus.id = species.genus_id
-        join family on family.id = genus.family_id
-        order by random()
-        """
-        images = self.db.connection.cursor().execute(image_query).fetchall()
-        family2image_urls = defaultdict(list)
-        for family, url in images:
-            family2image_urls[family].append(url)
-
-        families = list(map(dict, families))
-
-        for family in families:
-            family['image_urls'] = family2image_urls[family['name']]
+    def __init__(self, db=None):
+        super().__init__(db)
+        caches = get_quiz_caches(self.db)
+        self.recording_index = caches.recording_index
+        self.family_catalogue = caches.family_catalogue
+        self.recording = Recording(self.db)
 
+    def get_families_with_songs(self):
+        # Each page shows a different random selection of each family's images.
+        families = []
+        for family in self.family_catalogue.get():
+            family_images = family['images']
+            k = min(settings.n_family_images, len(family_images))
+            families.append(dict(family, images=random.sample(family_images, k)))
         return families
 
-    def _on_get_recording_quiz(self, recording, response):
-        template_path = os.path.join(settings.template_dir, 'recording_quiz.html')
+    def _on_get_recording_quiz(self, recording, response, token):
         families = self.get_families_with_songs()
-        response.body = (load_template(template_path)
+        response.text = (load_template('recording_quiz.html')
                          .render(recording=recording,
-                                 families=families))
+                                 families=families,
+                                 token=token))
         response.status = falcon.HTTP_200
         response.content_type = falcon.MEDIA_HTML
 
-    def on_get(self, request, response):
+    def get_recording(self, recording_id):
         # TODO: species.id is not used
         recording_query = """
         select recording.id,
-               species.id as species_id, species.name as species_name, species.english_name,
-               genus.name as genus_name,
-               family.id as family_id
+               taxon.species_id, taxon.species_name, taxon.species_english_name as english_name,
+               taxon.genus_name,
+               taxon.family_id
         from recording
-        inner join species on recording.species_id = species.id
-        inner join image on image.species_id = species.id
-        inner join genus on genus.id = species.genus_id
-        inner join family on family.id = genus.family_id
-        where (recording.type like '%song%'
-               and not family.name in ('Hirundinidae'))
-        order by random()
-        limit 1
+        inner join taxon on taxon.species_id = recording.species_id
+        where recording.id = ?
         """
-        recording = self.db.connection.cursor().execute(recording_query).fetchone()
-        self._on_get_recording_quiz(recording, response)
-
-        from clint.textui import colored; red = lambda s: colored.red(s, bold=True)
-        print(red(f"Truth: {dict(recording)}"))
-
-    def on_post(self, request, response):
-        form_data = parse_form_data(request)
-
-        from clint.textui import colored; red = lambda s: colored.red(s, bold=True)
-        print(red(f'form data: {form_data}'))
+        return self.db.execute(recording_query, (recording_id,)).fetchone()
 
+    def get_recordings(self, recording_ids):
+        # The recordings with the given IDs, in the same order.
         query = f"""
-        select family.id from recording
-        inner join species on species.id = recording.species_id
-        inner join genus on genus.id = species.genus_id
-        inner join family on family.id = genus.family_id
-        where recording.id = {form_data['recording_id']}
+        select recording.id, recording.species_id, taxon.family_id
+        from recording
+        inner join taxon on taxon.species_id = recording.species_id
+        where recording.id in ({', '.join(['?'] * len(recording_ids))})
         """
-        [species_family_id] = self.db.execute(query).fetchone()
-        species_family_id = int(species_family_id)
+        recordings = {row['id']: row for row in self.db.execute(query, recording_ids).fetchall()}
+        return [recordings[id] for id in recording_ids]
 
-        from clint.textui import colored; red = lambda s: colored.red(s, bold=True)
-        print(red('recording %s is family %s' % (form_data['recording_id'], species_family_id)))
+    def on_get(self, request, response):
+        recording = self.get_recording(self.recording_index.choice())
+        self._on_get_recording_quiz(recording, response,
+                                    tokens.issue('recording', recording['id'], recording))
+        logger.info('recording quiz question', extra={'recording': dict(recording)})
 
-        if form_data['family_id'] == species_family_id:
+    def on_post(self, request, response):
+        form_data = parse_form_data(request, ['family_id', 'recording_id'], ['token'])
+        correct = self.check_recording_answer(form_data, 'family_id')
+        logger.info('recording quiz answer',
+                    extra={'form_data': without_token(form_data), 'correct': correct})
+
+        if correct:
             # TODO: sharing Recording() view for second stage of quiz; this is starting to get
             # confusing.
-            Recording().on_get(request, response, **form_data)
+            self.recording.on_get(request, response, **form_data)
         else:
             recording = {'id': form_data['recording_id']}
-            self._on_get_recording_quiz(recording, response)
+            self._on_get_recording_quiz(recording, response, form_data.get('token'))
 
 
 class ImageQuiz(BaseResource):
 
-    def _group_recording_by_species(self, query_results):
-        grouped_results = defaultdict(dict)
-        for el in query_results:
-            key = '{english_name} ({genus_name} {species_name})'.format(**el)
-            species = grouped_results[key]
-            if 'recording_ids' in grouped_results[key]:
-                species['recording_ids'].append(el['recording_id'])
-            else:
-                species['recording_ids'] = [el['recording_id']]
-            species['species_id'] = el['species_id']
-        return grouped_results
+    def __init__(self, db=None):
+        super().__init__(db)
+        caches = get_quiz_caches(self.db)
+        self.image_index = caches.image_index
+        self.quiz_species = caches.quiz_species
 
-    def get_species_with_songs(self, family_id):
-        species_query = f"""
-        select distinct species.id as species_id, genus.name as genus_name, species.name as species_name, species.english_name, recording.id as recording_id
-        from recording join species on species.id = recording.species_id
-        join genus on genus.id = species.genus_id
-        join family on family.id = genus.family_id
-        where recording.type like '%song%'
-        and family.id = {family_id}
-        and not family.name in ('Hirundinidae')
-        order by family.weight
-        """
-        results = self.db.connection.cursor().execute(species_query).fetchall()
-        return self._group_recording_by_species(results)
+    def get_species_options(self, species_id):
+        return self.quiz_species.options(species_id, settings.n_options)
 
-    def _on_get_image_quiz(self, image, response):
-        template_path = os.path.join(settings.template_dir, 'image_quiz.html')
-        species = self.get_species_with_songs(image['family_id'])
-        response.body = (load_template(template_path)
+    def _on_get_image_quiz(self, image, response, token):
+        species = self.get_species_options(image['species_id'])
+        response.text = (load_template('image_quiz.html')
                          .render(image=image,
-                                 species=species))
+                                 species=species,
+                                 token=token))
         response.status = falcon.HTTP_200
         response.content_type = falcon.MEDIA_HTML
 
-    def on_get(self, request, response):
+    def get_image(self, image_id):
         image_query = """
-        select image.id, image.url, family.id as family_id, family.name as family_name, family.english_name as family_english_name, family.weight as weight, species.id as species_id from image
-        join species on image.species_id = species.id
-        inner join genus on genus.id = species.genus_id
-        inner join family on family.id = genus.family_id
-        where image.id in (
-          select image.id from image
-          join recording on recording.species_id = image.species_id
-          where type like '%song%'
-          order by random()
-          limit 1
-        )
-        and not family.name in ('Hirundinidae')
+        select image.id, image.url, image.sha256, taxon.family_id, taxon.family_name, taxon.family_english_name, taxon.family_weight as weight, taxon.species_id from image
+        join taxon on taxon.species_id = image.species_id
+        where image.id = ?
         """
-        image = self.db.connection.cursor().execute(image_query).fetchone()
-        self._on_get_image_quiz(image, response)
+        return self.db.execute(image_query, (image_id,)).fetchone()
+
+    def get_images(self, image_ids):
+        # The images with the given IDs, in the same order.
+        image_query = f"""
+        select image.id, image.url, image.sha256, taxon.family_id, taxon.species_id from image
+        join taxon on taxon.species_id = image.species_id
+        where image.id in ({', '.join(['?'] * len(image_ids))})
+        """
+        images = {row['id']: row for row in self.db.execute(image_query, image_ids).fetchall()}
+        return [images[id] for id in image_ids]
 
-        from clint.textui import colored; red = lambda s: colored.red(s, bold=True)
-        print(red(f"Truth: {dict(image)}"))
+    def on_get(self, request, response):
+        image = self.get_image(self.image_index.choice())
+        self._on_get_image_quiz(image, response, tokens.issue('image', image['id'], image))
+        logger.info('image quiz question', extra={'image': dict(image)})
 
     def on_post(self, request, response):
-        form_data = parse_form_data(request)
+        form_data = parse_form_data(request, ['species_id', 'image_id'], ['token'])
+        correct = self.check_image_answer(form_data)
+        logger.info('image quiz answer',
+                    extra={'form_data': without_token(form_data), 'correct': correct})
 
-        from clint.textui import colored; red = lambda s: colored.red(s, bold=True)
-        print(red(f'form data: {form_data}'))
-        image_id = form_data['image_id']
-        guessed_species_id = form_data['species_id']
+        if correct:
+            response.text = 'Success!'
+            response.status = falcon.HTTP_200
+            response.content_type = falcon.MEDIA_HTML
+        else:
+            self._on_get_image_quiz(self.get_existing_image(form_data['image_id']), response,
+                                    form_data.get('token'))
 
-        query = f"""
-        select species.id from image
-        inner join species on species.id = image.species_id
-        inner join genus on genus.id = species.genus_id
-        inner join family on family.id = genus.family_id
-        where image.id = {image_id}
+    def get_existing_image(self, image_id):
+        image = self.get_image(image_id)
+        if image is None:
+            raise falcon.HTTPNotFound()
+        return image
+
+    def check_image_answer(self, form_data):
+        # Whether form_data['species_id'] is right for the image, from the answer token if it
+        # can tell, else from the database.
+        correct = tokens.check(form_data.get('token'), 'image', form_data['image_id'],
+                               'species_id', form_data['species_id'])
+        if correct is None:
+            image = self.get_existing_image(form_data['image_id'])
+            correct = form_data['species_id'] == image['species_id']
+        return correct
+
+
+def set_json(response, data):
+    response.text = json.dumps(data, separators=(',', ':'))
+    response.content_type = falcon.MEDIA_JSON
+    response.status = falcon.HTTP_200
+
+
+def recording_url(recording_id):
+    return '/recordings/%d' % recording_id
+
+
+class RecordingQuizApi(RecordingQuiz):
+    # The recording quiz as JSON, with only IDs, names and URLs and no page rendering.
+
+    def on_get(self, request, response):
+        recording = self.get_recording(self.recording_index.choice())
+        response.cache_control = ['no-store']
+        set_json(response, {
+            'recording_id': recording['id'],
+            'recording_url': recording_url(recording['id']),
+            'token': tokens.issue('recording', recording['id'], recording),
+            'options': self.get_family_options(),
+        })
+        logger.info('recording quiz question', extra={'recording': dict(recording)})
+
+    def get_family_options(self):
+        return [
+            {
+                'family_id': family['id'],
+                'name': family['name'],
+                'english_name': family['english_name'],
+                'image_urls': [images.image_src(url, sha256) for url, sha256 in family['images']],
+            }
+            for family in self.get_families_with_songs()
+        ]
+
+    def on_post(self, request, response):
+        # A right family answer comes with the family's species, to be answered at
+        # /api/recordings.
+        form_data = parse_form_data(request, ['family_id', 'recording_id'], ['token'])
+        result = {'correct': self.check_recording_answer(form_data, 'family_id')}
+        logger.info('recording quiz answer',
+                    extra={'form_data': without_token(form_data), **result})
+        if result['correct']:
+            result['species_options'] = self.get_family_species(form_data['family_id'])
+        set_json(response, result)
+
+    def get_family_species(self, family_id):
+        # From the snapshot, without a query, unless there is none of the database's build.
+        taxonomy = snapshot.load(self.db.build_id())
+        if taxonomy is None:
+            return self._query_family_species(family_id)
+        return [
+            {
+                'species_id': species.id,
+                'name': '%s %s' % (taxonomy.genus(species.genus_id).name, species.name),
+                'english_name': species.english_name,
+                'image_urls': [images.image_src(image.url, image.sha256)
+                               for image in taxonomy.images_of_species(species.id)],
+            }
+            for species in taxonomy.species_of_family(family_id)
+            if taxonomy.recording_count(species.id)
+        ]
+
+    def _query_family_species(self, family_id):
+        query = """
+        select taxon.species_id as id, taxon.genus_name as genus, taxon.species_name as name,
+               taxon.species_english_name as english_name, image.url, image.sha256
+        from taxon
+        left join image on image.species_id = taxon.species_id
+        where taxon.family_id = ?
+        and exists (select 1 from recording where recording.species_id = taxon.species_id)
+        order by taxon.genus_name, taxon.species_name
         """
-        [actual_species_id] = self.db.execute(query).fetchone()
-        actual_species_id = int(actual_species_id)
+        species = OrderedDict()
+        for row in self.db.execute(query, (family_id,)).fetchall():
+            if row['id'] not in species:
+                species[row['id']] = {
+                    'species_id': row['id'],
+                    'name': '%s %s' % (row['genus'], row['name']),
+                    'english_name': row['english_name'],
+                    'image_urls': [],
+                }
+            if row['url']:
+                species[row['id']]['image_urls'].append(images.image_src(row['url'], row['sha256']))
+        return list(species.values())
+
+
+class RecordingApi(BaseResource):
 
-        from clint.textui import colored; red = lambda s: colored.red(s, bold=True)
-        print(red('image %s is species %s' % (form_data['species_id'], actual_species_id)))
+    def on_post(self, request, response):
+        form_data = parse_form_data(request, ['species_id', 'recording_id'], ['token'])
+        set_json(response, {'correct': self.check_recording_answer(form_data, 'species_id')})
 
-        if guessed_species_id == actual_species_id:
-            response.body = 'Success!'
-            response.status = falcon.HTTP_200
-            response.content_type = falcon.MEDIA_HTML
+
+def species_options(species_with_songs):
+    return [
+        {
+            'species_id': species['species_id'],
+            'name': name,
+            'recording_urls': [recording_url(id) for id in species['recording_ids']],
+        }
+        for name, species in species_with_songs.items()
+    ]
+
+
+def get_deck_size(request):
+    size = request.get_param_as_int('size')
+    if size is None:
+        return settings.deck_size
+    if not 1 <= size <= settings.max_deck_size:
+        raise falcon.HTTPBadRequest(
+            title='Invalid deck size',
+            description='size must be between 1 and %d' % settings.max_deck_size)
+    return size
+
+
+class RecordingQuizDeckApi(object):
+    # ?size= distinct recording questions in one response, so that clients can prefetch
+    # the audio. Every question has the same family options, listed once; answers are
+    # checked at /api/recording-quiz, whose index the deck is drawn from.
+
+    def __init__(self, quiz):
+        self.quiz = quiz
+
+    def on_get(self, request, response):
+        recording_ids = self.quiz.recording_index.sample(get_deck_size(request))
+        response.cache_control = ['no-store']
+        set_json(response, {
+            'questions': [
+                {
+                    'recording_id': recording['id'],
+                    'recording_url': recording_url(recording['id']),
+                    'token': tokens.issue('recording', recording['id'], recording),
+                }
+                for recording in self.quiz.get_recordings(recording_ids)
+            ],
+            'options': self.quiz.get_family_options(),
+        })
+
+
+class ImageQuizApi(ImageQuiz):
+    # The image quiz as JSON, with only IDs, names and URLs and no page rendering.
+
+    def on_get(self, request, response):
+        image = self.get_image(self.image_index.choice())
+        response.cache_control = ['no-store']
+        set_json(response, {
+            'image_id': image['id'],
+            'image_url': images.image_src(image['url'], image['sha256']),
+            'family_id': image['family_id'],
+            'token': tokens.issue('image', image['id'], image),
+            'options': species_options(self.get_species_options(image['species_id'])),
+        })
+        logger.info('image quiz question', extra={'image': dict(image)})
+
+    def on_post(self, request, response):
+        form_data = parse_form_data(request, ['species_id', 'image_id'], ['token'])
+        result = {'correct': self.check_image_answer(form_data)}
+        logger.info('image quiz answer',
+                    extra={'form_data': without_token(form_data), **result})
+        set_json(response, result)
+
+
+class ImageQuizDeckApi(object):
+    # ?size= distinct image questions in one response, each with its own options;
+    # answers are checked at /api/image-quiz.
+
+    def __init__(self, quiz):
+        self.quiz = quiz
+
+    def on_get(self, request, response):
+        deck = self.quiz.get_images(self.quiz.image_index.sample(get_deck_size(request)))
+        response.cache_control = ['no-store']
+        set_json(response, {
+            'questions': [
+                {
+                    'image_id': image['id'],
+                    'image_url': images.image_src(image['url'], image['sha256']),
+                    'family_id': image['family_id'],
+                    'token': tokens.issue('image', image['id'], image),
+                    'options': species_options(self.quiz.get_species_options(image['species_id'])),
+                }
+                for image in deck
+            ],
+        })
+
+
+def without_token(form_data):
+    # Form data as logged: answer tokens are signed credentials and stay out of the logs.
+    return {key: value for key, value in form_data.items() if key != 'token'}
+
+
+def parse_form_data(request, fields, optional_text_fields=()):
+    # The integer `fields`, and those of `optional_text_fields` that are present, of a JSON
+    # object or urlencoded form body of at most settings.max_form_size bytes.
+    too_large = falcon.HTTPPayloadTooLarge(
+        title='Request body too large',
+        description='at most %d bytes are accepted' % settings.max_form_size)
+    if request.content_length is not None and request.content_length > settings.max_form_size:
+        raise too_large
+    # Under ASGI the body has already been read, without blocking, by jacamar.asgi.
+    body = getattr(request.context, 'body', None)
+    if body is None:
+        body = request.bounded_stream.read(settings.max_form_size + 1)
+    if len(body) > settings.max_form_size:
+        raise too_large
+
+    media_type = (request.content_type or '').split(';')[0].strip().lower()
+    try:
+        if media_type == 'application/json':
+            data = json.loads(body.decode('utf-8'))
         else:
-            image_query = f"""
-        select image.id, image.url, family.id as family_id, family.name as family_name, family.english_name as family_english_name, family.weight as weight, species.id as species_id from image
-                join species on image.species_id = species.id
-                inner join genus on genus.id = species.genus_id
-                inner join family on family.id = genus.family_id
-                where image.id = {image_id}
-            """
-            image = self.db.connection.cursor().execute(image_query).fetchone()
-            self._on_get_image_quiz(image, response)
-
-
-def parse_form_data(request):
-    SEP = '--'
-    raw_data = request.stream.read().decode('utf-8')
-    _, raw_data = raw_data.split('=', 1)
-    raw_data = raw_data.split(SEP)
-    assert len(raw_data) % 2 == 0
-    raw_data = iter(raw_data)
-    data = {}
-    while True:
-        try:
-            key = next(raw_data)
-        except StopIteration:
-            return data
+            data = dict(parse_qsl(body.decode('utf-8')))
+    except ValueError:
+        raise falcon.HTTPBadRequest(title='Invalid form',
+                                    description='the request body could not be parsed')
+    if not isinstance(data, dict):
+        raise falcon.HTTPBadRequest(title='Invalid form', description='expected a JSON object')
+
+    form_data = {}
+    for field in fields:
+        value = data.get(field)
+        if type(value) is int or isinstance(value, str) and value.isascii() and value.isdigit():
+            form_data[field] = int(value)
         else:
-            value = next(raw_data)
-            try:
-                value = int(value)
-            except ValueError:
-                pass
-            assert key not in data
-            data[key] = value
+            raise falcon.HTTPBadRequest(title='Invalid form',
+                                        description='%s must be an integer' % field)
+    for field in optional_text_fields:
+        value = data.get(field)
+        if value is not None:
+            if not isinstance(value, str):
+                raise falcon.HTTPBadRequest(title='Invalid form',
+                                            description='%s must be a string' % field)
+            form_data[field] = value
+    return form_data
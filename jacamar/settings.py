@@ -2,9 +2,92 @@ import os
 
 
 n_options = 9
+n_family_images = 5
+
+# Quiz questions use recordings of these kinds ('song', 'call' or 'other'), from families
+# not listed in quiz_excluded_families, and, when set, of at least quiz_min_duration and at
+# most quiz_max_duration seconds (recordings of unknown duration are always used).
+quiz_recording_kinds = ['song']
+quiz_excluded_families = ['Hirundinidae']
+quiz_min_duration = None
+quiz_max_duration = None
+
+# Quiz options are drawn from the max_distractors most similar species (or families) to the
+# answer; see jacamar/distractors.py. With distractor_difficulty 1 they are always the most
+# similar, with 0 drawn evenly from all max_distractors.
+max_distractors = 40
+distractor_difficulty = 0.5
 
 base_dir = os.path.abspath(os.path.join(os.path.abspath(__file__), os.pardir, os.pardir))
 working_dir = os.path.abspath(os.path.join(os.path.abspath(__file__), os.pardir))
 recording_dir = os.path.join(base_dir, 'recordings')
 template_dir = os.path.join(working_dir, 'templates')
+template_cache_dir = os.path.join(base_dir, '.template_cache')
+image_store_dir = os.path.join(base_dir, 'images')
 db_file = os.path.join(base_dir, 'jacamar.sqlite')
+# Written by `make tables` and `make db-update`; see jacamar/snapshot.py.
+snapshot_file = os.path.join(base_dir, 'tables', 'taxonomy.snapshot')
+
+# Connections are read-only. Only set db_immutable if the database file is never rewritten
+# while the server is running; SQLite then skips all locking and change detection.
+db_immutable = False
+db_mmap_size = 256 * 1024 * 1024
+
+# Rendered family image and recording list pages, per worker. Clients must revalidate
+# (with If-None-Match) before reusing a page.
+page_cache_size = 256
+page_cache_control = ['public', 'no-cache']
+
+# Questions per /api/*-quiz/deck response, by default and at most.
+deck_size = 10
+max_deck_size = 50
+
+# Quiz questions carry a signed answer token, valid for answer_token_ttl seconds, so that
+# answers are checked without a database lookup. Tokens are signed with the first of
+# answer_token_keys and accepted with any of them: to rotate, put a new key first and drop
+# the old one once answer_token_ttl has passed. Without keys, a random key is created in
+# answer_token_key_file.
+answer_token_keys = []
+answer_token_key_file = os.path.join(base_dir, '.answer_token_key')
+answer_token_ttl = 3600
+
+# Largest accepted quiz answer body (JSON or urlencoded).
+max_form_size = 4096
+
+# Text responses of at least compression_min_size bytes are gzip-compressed, or compressed
+# with brotli if the optional brotli package is installed and the client accepts it.
+# Compressed bodies of pages with an ETag are kept, per worker, in an LRU cache of
+# compression_cache_size entries.
+compressible_types = ['text/html', 'text/plain', 'text/css', 'application/json',
+                      'application/javascript', 'image/svg+xml']
+compression_min_size = 1024
+compression_cache_size = 256
+gzip_level = 6
+brotli_quality = 5
+
+image_cache_control = ['public', 'max-age=31536000', 'immutable']
+
+# Frame offset tables of recently clipped recordings, per worker.
+mp3_frame_cache_size = 256
+
+# Recompile a template when its file's mtime changes, which costs a stat per render. Off
+# unless JACAMAR_TEMPLATE_AUTO_RELOAD=1, which `make serve-dev` sets.
+template_auto_reload = os.environ.get('JACAMAR_TEMPLATE_AUTO_RELOAD') == '1'
+
+# Threads per jacamar.asgi worker for database queries, page rendering and file reads,
+# and so the most requests a worker handles at once outside of its event loop. Files are
+# read asgi_stream_block_size bytes at a time.
+asgi_threads = 32
+asgi_stream_block_size = 64 * 1024
+
+# A thread in each worker writes its metrics here every metrics_flush_interval seconds;
+# /metrics reports the sum over all files. Emptied by `make serve`.
+metrics_dir = os.path.join(base_dir, '.metrics')
+metrics_flush_interval = 1.0
+
+# Server logs are JSON lines on stderr, written by a background thread. Only a random
+# log_sample_rate fraction of records below WARNING is kept; records are dropped rather
+# than delaying requests when more than log_queue_size are waiting.
+log_level = 'INFO'
+log_sample_rate = 1.0
+log_queue_size = 10000
@@ -0,0 +1,314 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from operator import itemgetter
+
+from jacamar import settings
+
+logger = logging.getLogger(__name__)
+
+# A read-only binary copy of the taxonomy, recordings and images, written by
+# bin/create_tables.py and bin/update_db.py and memory-mapped by each worker, so that the
+# pages are shared by all workers through the page cache and a lookup only decodes the
+# records it returns.
+#
+# The header carries the id of the build the snapshot was written for, which the database
+# records in its manifest: a snapshot is only used with the database of the same build, so
+# that one written by `make tables` before the database is loaded, or left behind by a
+# failed load or update, is never read against a database whose IDs differ.
+#
+# Layout (little-endian): a header, a table of sections, then the sections. Every section is
+# an array of fixed-width records. Strings are (offset, length) pairs into the UTF-8 string
+# section. Species are grouped by family and recordings and images by species, so each
+# family record holds the range of its species, and each species record the ranges of its
+# recordings and images. Each table has an index section mapping IDs to record positions.
+
+MAGIC = b'JACAMAR\0'
+FORMAT_VERSION = 2
+
+HEADER = struct.Struct('<8sIIQ')  # magic, format version, section count, build id
+SECTION = struct.Struct('<QII')  # offset, record count, record size
+
+NO_RECORD = 0xFFFFFFFF
+
+# Fields, in order: a range is a (start, count) pair of record positions.
+#   order: id, name, english_name
+#   family: id, name, english_name, order_id, weight, species range
+#   genus: id, name, english_name, family_id
+#   species: id, name, english_name, genus_id, family_id, recording range, image range
+#   recording: id, path, species_id, type, kind (an index into KINDS)
+#   image: id, url, species_id, sha256
+RECORD_FORMATS = {
+    'order': '<I2I2I',
+    'family': '<I2I2IId2I',
+    'genus': '<I2I2II',
+    'species': '<I2I2III2I2I',
+    'recording': '<I2II2IB',
+    'image': '<I2II2I',
+}
+TABLES = list(RECORD_FORMATS)
+SECTIONS = ['strings'] + TABLES + [table + '_index' for table in TABLES]
+INDEX = struct.Struct('<I')
+
+KINDS = ['song', 'call', 'other']
+
+Order = namedtuple('Order', ['id', 'name', 'english_name'])
+Family = namedtuple('Family', ['id', 'name', 'english_name', 'order_id', 'weight'])
+Genus = namedtuple('Genus', ['id', 'name', 'english_name', 'family_id'])
+Species = namedtuple('Species', ['id', 'name', 'english_name', 'genus_id', 'family_id'])
+Recording = namedtuple('Recording', ['id', 'path', 'species_id', 'type', 'kind'])
+Image = namedtuple('Image', ['id', 'url', 'species_id', 'sha256'])
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write(path, build_id, orders, families, genera, species, recordings, images):
+    # Writes the tables (lists of dicts with the columns of bin/load_tables.sql, order_id
+    # for a family's order) of build `build_id` to `path`, replacing it atomically.
+    strings = StringTable()
+    genus_family = {genus['id']: genus['family_id'] for genus in genera}
+    genus_name = {genus['id']: genus['name'] for genus in genera}
+    species = sorted(species, key=lambda s: (genus_family[s['genus_id']],
+                                             genus_name[s['genus_id']], s['name']))
+    species_position = {s['id']: i for i, s in enumerate(species)}
+    recordings = sorted(recordings, key=lambda r: (species_position[r['species_id']], r['id']))
+    images = sorted(images, key=lambda i: (species_position[i['species_id']], i['id']))
+
+    family_species = ranges(species, lambda s: genus_family[s['genus_id']])
+    species_recordings = ranges(recordings, itemgetter('species_id'))
+    species_images = ranges(images, itemgetter('species_id'))
+
+    records = {
+        'order': [(o['id'], *strings.add(o['name']), *strings.add(o['english_name']))
+                  for o in sorted(orders, key=itemgetter('id'))],
+        'family': [(f['id'], *strings.add(f['name']), *strings.add(f['english_name']),
+                    f['order_id'] or 0, float(f['weight']),
+                    *family_species.get(f['id'], (0, 0)))
+                   for f in sorted(families, key=itemgetter('id'))],
+        'genus': [(g['id'], *strings.add(g['name']), *strings.add(g['english_name'] or ''),
+                   g['family_id'])
+                  for g in sorted(genera, key=itemgetter('id'))],
+        'species': [(s['id'], *strings.add(s['name']), *strings.add(s['english_name']),
+                     s['genus_id'], genus_family[s['genus_id']],
+                     *species_recordings.get(s['id'], (0, 0)),
+                     *species_images.get(s['id'], (0, 0)))
+                    for s in species],
+        'recording': [(r['id'], *strings.add(r['path']), r['species_id'],
+                       *strings.add(r['type']), KINDS.index(r['kind']))
+                      for r in recordings],
+        'image': [(i['id'], *strings.add(i['url']), i['species_id'],
+                   *strings.add(i['sha256'] or ''))
+                  for i in images],
+    }
+
+    sections = {'strings': (strings.data(), len(strings.data()), 1)}
+    for table in TABLES:
+        record = struct.Struct(RECORD_FORMATS[table])
+        rows = records[table]
+        sections[table] = (b''.join(record.pack(*row) for row in rows), len(rows), record.size)
+        index = [NO_RECORD] * (max((row[0] for row in rows), default=0) + 1)
+        for position, row in enumerate(rows):
+            index[row[0]] = position
+        sections[table + '_index'] = (
+            struct.pack('<%dI' % len(index), *index), len(index), INDEX.size)
+
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    table = []
+    for name in SECTIONS:
+        offset = align(offset)
+        data, count, size = sections[name]
+        table.append((offset, count, size))
+        offset += len(data)
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(SECTIONS), build_id))
+        for entry in table:
+            fp.write(SECTION.pack(*entry))
+        for name, (offset, _, _) in zip(SECTIONS, table):
+            fp.write(b'\0' * (offset - fp.tell()))
+            fp.write(sections[name][0])
+    os.replace(tmp_path, path)
+
+
+def align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def ranges(rows, key):
+    # {key: (start, count)} of the runs of rows sharing a key.
+    result = {}
+    for position, row in enumerate(rows):
+        start, count = result.get(key(row), (position, 0))
+        result[key(row)] = (start, count + 1)
+    return result
+
+
+class StringTable:
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._offsets = {}
+
+    def add(self, string):
+        # (offset, length) of the string, stored once however often it is added.
+        data = string.encode('utf-8')
+        offset = self._offsets.get(data)
+        if offset is None:
+            offset = self._offsets[data] = self._size
+            self._chunks.append(data)
+            self._size += len(data)
+        return offset, len(data)
+
+    def data(self):
+        return b''.join(self._chunks)
+
+
+class Snapshot:
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.inode = os.fstat(fp.fileno()).st_ino
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, n_sections, self.build_id = HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or version != FORMAT_VERSION or n_sections != len(SECTIONS):
+            self._mmap.close()
+            raise SnapshotError('%s is not a version %d snapshot' % (path, FORMAT_VERSION))
+        self._view = memoryview(self._mmap)
+        self._sections = {
+            name: SECTION.unpack_from(self._mmap, HEADER.size + i * SECTION.size)
+            for i, name in enumerate(SECTIONS)
+        }
+        self._records = {table: struct.Struct(RECORD_FORMATS[table]) for table in TABLES}
+
+    def _string(self, offset, length):
+        start = self._sections['strings'][0] + offset
+        return str(self._view[start:start + length], 'utf-8')
+
+    def _record(self, table, position):
+        offset, _, size = self._sections[table]
+        return self._records[table].unpack_from(self._mmap, offset + position * size)
+
+    def _position(self, table, id):
+        offset, count, _ = self._sections[table + '_index']
+        if not 0 <= id < count:
+            return None
+        position, = INDEX.unpack_from(self._mmap, offset + id * INDEX.size)
+        return None if position == NO_RECORD else position
+
+    def _get(self, table, id, make):
+        position = self._position(table, id)
+        return None if position is None else make(self._record(table, position))
+
+    def _range(self, table, start, count, make):
+        return [make(self._record(table, position)) for position in range(start, start + count)]
+
+    def _order(self, r):
+        return Order(r[0], self._string(*r[1:3]), self._string(*r[3:5]))
+
+    def _family(self, r):
+        return Family(r[0], self._string(*r[1:3]), self._string(*r[3:5]), r[5] or None, r[6])
+
+    def _genus(self, r):
+        return Genus(r[0], self._string(*r[1:3]), self._string(*r[3:5]), r[5])
+
+    def _species(self, r):
+        return Species(r[0], self._string(*r[1:3]), self._string(*r[3:5]), r[5], r[6])
+
+    def _recording(self, r):
+        return Recording(r[0], self._string(*r[1:3]), r[3], self._string(*r[4:6]), KINDS[r[6]])
+
+    def _image(self, r):
+        return Image(r[0], self._string(*r[1:3]), r[3], self._string(*r[4:6]) or None)
+
+    def order(self, id):
+        return self._get('order', id, self._order)
+
+    def family(self, id):
+        return self._get('family', id, self._family)
+
+    def families(self):
+        return self._range('family', 0, self._sections['family'][1], self._family)
+
+    def genus(self, id):
+        return self._get('genus', id, self._genus)
+
+    def species(self, id):
+        return self._get('species', id, self._species)
+
+    def recording(self, id):
+        return self._get('recording', id, self._recording)
+
+    def image(self, id):
+        return self._get('image', id, self._image)
+
+    def species_of_family(self, family_id):
+        # Ordered by genus and species name.
+        position = self._position('family', family_id)
+        if position is None:
+            return []
+        start, count = self._record('family', position)[7:9]
+        return self._range('species', start, count, self._species)
+
+    def recordings_of_species(self, species_id):
+        position = self._position('species', species_id)
+        if position is None:
+            return []
+        start, count = self._record('species', position)[7:9]
+        return self._range('recording', start, count, self._recording)
+
+    def recording_count(self, species_id):
+        position = self._position('species', species_id)
+        return 0 if position is None else self._record('species', position)[8]
+
+    def images_of_species(self, species_id):
+        position = self._position('species', species_id)
+        if position is None:
+            return []
+        start, count = self._record('species', position)[9:11]
+        return self._range('image', start, count, self._image)
+
+
+_snapshot = None
+_invalid_inode = None
+_lock = threading.Lock()
+
+
+def load(build_id):
+    # The snapshot at settings.snapshot_file, mapped again when the file is replaced, or
+    # None if there is none, it cannot be read (an older format, a truncated file) or it was
+    # written for another build than `build_id`.
+    global _snapshot, _invalid_inode
+    if build_id is None:
+        return None
+    try:
+        inode = os.stat(settings.snapshot_file).st_ino
+    except FileNotFoundError:
+        return None
+    if inode == _invalid_inode:
+        return None
+    snapshot = _snapshot
+    if snapshot is None or snapshot.inode != inode:
+        with _lock:
+            if inode == _invalid_inode:
+                return None
+            if _snapshot is None or _snapshot.inode != inode:
+                try:
+                    _snapshot = Snapshot(settings.snapshot_file)
+                except (SnapshotError, ValueError) as ex:
+                    # Logged once per file; the database is queried instead.
+                    logger.warning('cannot read the snapshot', extra={
+                        'path': settings.snapshot_file, 'error': str(ex)})
+                    _invalid_inode = inode
+                    return None
+            snapshot = _snapshot
+    return snapshot if snapshot.build_id == build_id else None
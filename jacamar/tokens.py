@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from functools import lru_cache
+
+from jacamar import settings
+
+
+# Answers a token can check, by question kind, in the order their tags appear.
+ANSWER_FIELDS = {
+    'recording': ['family_id', 'species_id'],
+    'image': ['species_id'],
+}
+
+TAG_SIZE = 12
+
+
+# An answer token is "<key id>.<expires>.<question id>.<tag>...", with one tag per answer
+# field: a truncated HMAC of the question, the expiry time and the right answer. A guess is
+# checked by recomputing the tag for the guessed answer, so the token does not reveal the
+# answer and a quiz POST can be checked without a database lookup.
+
+
+@lru_cache(maxsize=None)
+def load_keys():
+    # {key id: key}, and the id of the key new tokens are signed with.
+    values = list(settings.answer_token_keys)
+    if not values:
+        values = [read_key_file(settings.answer_token_key_file)]
+    keys = {}
+    for value in values:
+        key = value.encode('utf-8')
+        keys[hashlib.sha256(key).hexdigest()[:8]] = key
+    return keys, next(iter(keys))
+
+
+def read_key_file(path):
+    # A random key shared by all workers on this host, created on first use.
+    if not os.path.exists(path):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as fp:
+            fp.write(secrets.token_hex(32))
+        os.chmod(tmp_path, 0o600)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path) as fp:
+        return fp.read().strip()
+
+
+def tag(key, kind, question_id, expires, field, answer):
+    message = '%s:%d:%d:%s:%d' % (kind, question_id, expires, field, answer)
+    digest = hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()[:TAG_SIZE]
+    return base64.urlsafe_b64encode(digest).decode('ascii')
+
+
+def issue(kind, question_id, answers):
+    keys, key_id = load_keys()
+    expires = int(time.time()) + settings.answer_token_ttl
+    tags = [tag(keys[key_id], kind, question_id, expires, field, answers[field])
+            for field in ANSWER_FIELDS[kind]]
+    return '.'.join([key_id, str(expires), str(question_id)] + tags)
+
+
+def check(token, kind, question_id, field, guess):
+    # Whether `guess` is the right `field` answer to the question, or None if the token
+    # cannot tell: missing, malformed, expired, signed with an unknown key, or issued for
+    # another question.
+    if not token:
+        return None
+    parts = token.split('.')
+    if len(parts) != 3 + len(ANSWER_FIELDS[kind]):
+        return None
+    key_id, expires, token_question_id = parts[:3]
+    keys, _ = load_keys()
+    key = keys.get(key_id)
+    if key is None or not expires.isdigit() or token_question_id != str(question_id):
+        return None
+    expires = int(expires)
+    if expires < time.time():
+        return None
+    expected = parts[3 + ANSWER_FIELDS[kind].index(field)]
+    return hmac.compare_digest(expected, tag(key, kind, question_id, expires, field, guess))
@@ -0,0 +1,55 @@
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'bin'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+from jacamar import settings  # noqa: E402
+
+
+def require_sqlite3():
+    if shutil.which('sqlite3') is None:
+        pytest.skip('the sqlite3 command line shell is not installed')
+
+
+def load_db(db_file):
+    # Loads tables/*.tsv with bin/load_tables.sql, as `make db` does.
+    require_sqlite3()
+    with open(os.path.join(REPO_DIR, 'bin', 'load_tables.sql')) as fp:
+        subprocess.run(['sqlite3', '--bail', db_file], stdin=fp, cwd=REPO_DIR, check=True,
+                       stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture(scope='session')
+def db_file(tmp_path_factory):
+    # The database and every file the app writes are kept out of the repository. Set
+    # before jacamar.resources is first imported, which opens settings.db_file.
+    work_dir = tmp_path_factory.mktemp('jacamar')
+    db_file = str(work_dir / 'jacamar.sqlite')
+    load_db(db_file)
+    settings.db_file = db_file
+    settings.snapshot_file = str(work_dir / 'taxonomy.snapshot')
+    settings.image_store_dir = str(work_dir / 'images')
+    settings.metrics_dir = str(work_dir / 'metrics')
+    settings.answer_token_key_file = str(work_dir / 'answer_token_key')
+    settings.log_level = 'WARNING'
+    return db_file
+
+
+@pytest.fixture(scope='session', params=['jacamar.app', 'jacamar.asgi'])
+def app(request, db_file):
+    # Every test using the app runs against both the WSGI and the ASGI entry point.
+    return importlib.import_module(request.param).application
+
+
+@pytest.fixture
+def client(app):
+    from falcon import testing
+    return testing.TestClient(app)
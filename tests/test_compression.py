@@ -0,0 +1,21 @@
+import threading
+
+import pytest
+
+from jacamar import compression
+
+
+@pytest.mark.parametrize('app', ['jacamar.asgi'], indirect=True)
+def test_asgi_compresses_in_thread_pool(client, monkeypatch):
+    # Not on the event loop, which would stall every other connection of the worker.
+    threads = []
+    compress = compression.compress
+
+    def recording_compress(encoding, data):
+        threads.append(threading.current_thread().name)
+        return compress(encoding, data)
+
+    monkeypatch.setattr(compression, 'compress', recording_compress)
+    response = client.simulate_get('/recording-quiz', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(threads) == 1 and threads[0].startswith('jacamar-asgi')
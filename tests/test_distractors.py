@@ -0,0 +1,48 @@
+from collections import Counter
+
+from jacamar import distractors
+
+# Two families of the same order: family 1 with two genera of three species, family 2 with
+# one species.
+FAMILIES = {1: (1, 50), 2: (1, 60)}
+SPECIES = {1: (1, 1), 2: (1, 1), 3: (1, 1), 4: (2, 1), 5: (2, 1), 6: (2, 1), 7: (3, 2)}
+
+
+def family_of(species_id):
+    return SPECIES[species_id][1]
+
+
+def test_species_options_within_family():
+    index = distractors.DistractorIndex(FAMILIES, SPECIES)
+    for difficulty in [0, 0.5, 1]:
+        for _ in range(50):
+            result = index.species_options(1, 4, difficulty)
+            assert len(result) == 4 and 1 in result
+            assert {family_of(id) for id in result} == {1}
+
+
+def test_species_options_of_small_family():
+    # Family 2 has a single species: the distractors come from the closest family.
+    index = distractors.DistractorIndex(FAMILIES, SPECIES)
+    result = index.species_options(7, 4)
+    assert len(result) == 4 and 7 in result
+    assert {family_of(id) for id in result if id != 7} == {1}
+
+    # Family 1 has six species, too few for eight options.
+    result = index.species_options(1, 8)
+    assert sorted(result) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_image_quiz_options_within_family(client):
+    # Options are drawn from the species with quiz recordings.
+    from jacamar import resources
+    _, _, quiz_species = resources.QuizSpecies(resources.database).get()
+    species_family = {id: species['family_id'] for id, species in quiz_species.items()}
+    family_size = Counter(species_family.values())
+    for _ in range(20):
+        quiz = client.simulate_get('/api/image-quiz').json
+        families = {species_family[option['species_id']] for option in quiz['options']}
+        if family_size[quiz['family_id']] >= len(quiz['options']):
+            assert families == {quiz['family_id']}
+        else:
+            assert quiz['family_id'] in families
@@ -0,0 +1,72 @@
+import csv
+import hashlib
+import http.server
+import os
+import threading
+from functools import partial
+from urllib.parse import urlsplit
+
+import pytest
+
+from jacamar import settings
+
+IMAGES = {'a.jpg': b'\xff\xd8\xff' + bytes(100), 'b.png': b'\x89PNG\r\n\x1a\n' + bytes(200)}
+
+
+@pytest.fixture
+def server(tmp_path):
+    # Serves IMAGES under /commons/, counting the requests.
+    root = tmp_path / 'www'
+    os.makedirs(root / 'commons')
+    for name, data in IMAGES.items():
+        (root / 'commons' / name).write_bytes(data)
+    paths = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+
+        def do_GET(self):
+            paths.append(self.path)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(Handler, directory=root))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % httpd.server_port, paths
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_images(server, tmp_path, monkeypatch):
+    from download_images import download_images
+
+    base_url, paths = server
+    monkeypatch.setattr(settings, 'image_store_dir', str(tmp_path / 'images'))
+    image_file = str(tmp_path / 'image.tsv')
+    with open(image_file, 'w') as fp:
+        fp.write('1\thttps://upload.wikimedia.org/commons/a.jpg\t1\t\n'
+                 '2\thttps://upload.wikimedia.org/commons/b.png\t2\t\n'
+                 '3\thttps://upload.wikimedia.org/commons/missing.jpg\t3\t\n')
+
+    # As with --base-url.
+    download_images(image_file, urlsplit(base_url), 2, 100, 0, 0)
+    with open(image_file, newline='') as fp:
+        rows = list(csv.reader(fp, delimiter='\t'))
+    digests = {name: hashlib.sha256(data).hexdigest() for name, data in IMAGES.items()}
+    assert rows == [
+        ['1', 'https://upload.wikimedia.org/commons/a.jpg', '1', digests['a.jpg']],
+        ['2', 'https://upload.wikimedia.org/commons/b.png', '2', digests['b.png']],
+        ['3', 'https://upload.wikimedia.org/commons/missing.jpg', '3', ''],
+    ]
+    for name, digest in digests.items():
+        with open(tmp_path / 'images' / digest[:2] / digest, 'rb') as fp:
+            assert fp.read() == IMAGES[name]
+    assert sorted(os.listdir(tmp_path / 'images')) == sorted(d[:2] for d in digests.values())
+    assert sorted(paths) == ['/commons/a.jpg', '/commons/b.png', '/commons/missing.jpg']
+
+    # Stored images are not downloaded again.
+    download_images(image_file, urlsplit(base_url), 2, 100, 0, 0)
+    assert sorted(paths) == ['/commons/a.jpg', '/commons/b.png', '/commons/missing.jpg',
+                             '/commons/missing.jpg']
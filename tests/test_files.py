@@ -0,0 +1,135 @@
+import pytest
+
+# One MPEG-1 layer III frame (128 kbit/s, 44.1 kHz) of silence, as in bench/synthetic.py.
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x00]) + bytes(413)
+N_FRAMES = 200
+
+
+@pytest.fixture
+def image_digest(db_file):
+    from jacamar import images
+    return images.store_image(b'\x89PNG\r\n\x1a\n' + bytes(100))
+
+
+@pytest.fixture
+def recording_file(db_file, tmp_path, monkeypatch):
+    # The recordings themselves are not in the repository.
+    from jacamar import resources
+    path = str(tmp_path / 'recording.mp3')
+    with open(path, 'wb') as fp:
+        fp.write(MP3_FRAME * N_FRAMES)
+    monkeypatch.setattr(resources.Recording, 'get_recording_path', lambda self, id: path)
+    return path
+
+
+def test_image_file(client, image_digest):
+    response = client.simulate_get('/image-files/' + image_digest)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/png'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert len(response.content) == 108
+
+
+def test_image_file_not_modified(client, image_digest):
+    response = client.simulate_get('/image-files/' + image_digest)
+    etag = response.headers['ETag']
+
+    response = client.simulate_get('/image-files/' + image_digest,
+                                   headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'Content-Type' not in response.headers
+    assert response.content == b''
+
+    response = client.simulate_get(
+        '/image-files/' + image_digest,
+        headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 304
+
+
+def test_image_file_head(client, image_digest):
+    response = client.simulate_head('/image-files/' + image_digest)
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == '108'
+    assert response.headers['Content-Type'] == 'image/png'
+    assert response.content == b''
+
+
+def test_recording_range(client, recording_file):
+    response = client.simulate_get('/recordings/1', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 10-19/%d' % (417 * N_FRAMES)
+    assert response.content == (MP3_FRAME * N_FRAMES)[10:20]
+
+    response = client.simulate_get('/recordings/1', headers={'Range': 'bytes=-5'})
+    assert response.status_code == 206
+    assert response.content == bytes(5)
+
+
+def test_recording_if_range(client, recording_file):
+    etag = client.simulate_get('/recordings/1').headers['ETag']
+    response = client.simulate_get('/recordings/1',
+                                   headers={'Range': 'bytes=10-19', 'If-Range': etag})
+    assert response.status_code == 206
+
+    # Strong comparison: the weak form of the same ETag does not match.
+    response = client.simulate_get('/recordings/1',
+                                   headers={'Range': 'bytes=10-19', 'If-Range': 'W/' + etag})
+    assert response.status_code == 200
+    assert len(response.content) == 417 * N_FRAMES
+
+
+def test_recording_head(client, recording_file):
+    response = client.simulate_head('/recordings/1')
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == str(417 * N_FRAMES)
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.content == b''
+
+
+def test_recording_not_modified(client, recording_file):
+    etag = client.simulate_get('/recordings/1').headers['ETag']
+    response = client.simulate_get('/recordings/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'Content-Type' not in response.headers
+
+
+def test_recording_clip(client, recording_file):
+    # 44100 / 1152 frames per second: 1 s from 2 s is frames 76 to 115.
+    response = client.simulate_get('/recordings/1', params={'start': '2', 'duration': '1'})
+    assert response.status_code == 200
+    assert response.content == MP3_FRAME * 39
+
+    response = client.simulate_get('/recordings/1', params={'start': '2', 'duration': '1e308'})
+    assert response.status_code == 200
+    assert response.content == MP3_FRAME * (N_FRAMES - 76)
+
+
+@pytest.mark.parametrize('params', [
+    {'start': 'x'},
+    {'start': 'nan'},
+    {'start': 'inf'},
+    {'duration': '-inf'},
+    {'start': '-1'},
+    {'duration': '0'},
+    {'start': '1e308'},
+    {'start': '60'},
+])
+def test_recording_invalid_clip(client, recording_file, params):
+    response = client.simulate_get('/recordings/1', params=params)
+    assert response.status_code == 400
+    assert response.json['title'] == 'Invalid clip'
+
+
+def test_recording_clip_not_mpeg(client, recording_file):
+    with open(recording_file, 'wb') as fp:
+        fp.write(b'not audio' * 100)
+    response = client.simulate_get('/recordings/1', params={'start': '1'})
+    assert response.status_code == 400
+    assert response.json['title'] == 'Invalid clip'
+
+
+def test_recording_not_found(client, db_file):
+    # Not in the snapshot, if any, nor in the database.
+    assert client.simulate_get('/recordings/999999').status_code == 404
+    assert client.simulate_head('/recordings/999999').status_code == 404
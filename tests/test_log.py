@@ -0,0 +1,31 @@
+import logging
+
+
+def test_configured_once(app):
+    # conftest imports both jacamar.app and jacamar.asgi, which both configure logging.
+    import jacamar.app  # noqa: F401
+    import jacamar.asgi  # noqa: F401
+    from jacamar import log
+
+    log.configure()
+    handlers = [handler for handler in logging.getLogger('jacamar').handlers
+                if isinstance(handler, log.NonBlockingQueueHandler)]
+    assert len(handlers) == 1
+
+
+def test_answer_token_not_logged(client, monkeypatch):
+    from jacamar import resources
+
+    logged = []
+    monkeypatch.setattr(resources.logger, 'info',
+                        lambda message, extra=None: logged.append((message, extra)))
+    quiz = client.simulate_get('/api/image-quiz').json
+    for path, body in [
+        ('/api/image-quiz', {'image_id': quiz['image_id'], 'species_id': 0}),
+        ('/image-quiz', {'image_id': quiz['image_id'], 'species_id': 0}),
+    ]:
+        client.simulate_post(path, json=dict(body, token=quiz['token']))
+    answers = [extra for message, extra in logged if message == 'image quiz answer']
+    assert len(answers) == 2
+    for extra in answers:
+        assert extra['form_data'] == {'image_id': quiz['image_id'], 'species_id': 0}
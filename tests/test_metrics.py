@@ -0,0 +1,26 @@
+import os
+import time
+
+from jacamar import metrics
+from jacamar import settings
+
+
+def test_requests_do_not_flush(client, monkeypatch):
+    flushes = []
+    monkeypatch.setattr(metrics, 'flush', lambda: flushes.append(1))
+    for path in ['/recording-quiz', '/metrics', '/images/3']:
+        assert client.simulate_get(path).status_code == 200
+    assert flushes == []
+
+
+def test_flushed_in_background(client):
+    client.simulate_get('/recording-quiz')
+    deadline = time.monotonic() + 10 * settings.metrics_flush_interval
+    while not os.path.exists(metrics.worker_file()):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_collect_includes_own_requests(client):
+    client.simulate_get('/recording-quiz')
+    assert 'route="/recording-quiz"' in client.simulate_get('/metrics').text
@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.mark.parametrize('accept_encoding', [None, 'gzip'])
+def test_page_not_modified(client, accept_encoding):
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    client.simulate_get('/recordings')
+    response = client.simulate_get('/recordings', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/html')
+    etag = response.headers['ETag']
+    # Strong: the page's own, or that of its compressed body.
+    assert not etag.startswith('W/')
+    assert etag.endswith('-gzip"') == (accept_encoding == 'gzip')
+
+    response = client.simulate_get('/recordings', headers={'If-None-Match': etag, **headers})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.headers['X-Cache'] == 'hit'
+    assert 'Content-Type' not in response.headers
+    assert response.content == b''
+
+
+def test_page_modified(client):
+    response = client.simulate_get('/images/3', headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    assert 'Little Tinamou' in client.simulate_get('/images/1').text
+
+
+@pytest.mark.parametrize('path', ['/images/abc', '/images/1%20or%201', '/images/999999',
+                                  '/recordings/abc'])
+def test_page_not_found(client, path):
+    from jacamar import resources
+    pages = len(resources.page_cache._pages)
+    assert client.simulate_get(path).status_code == 404
+    assert len(resources.page_cache._pages) == pages
+
+
+def test_recording_list(client):
+    response = client.simulate_get('/recordings')
+    assert response.status_code == 200
+    assert 'Little Tinamou' in response.text
+
+
+def test_page_not_modified_other_encoding(client):
+    # A compressed page revalidated without Accept-Encoding: the same page, so 304, with the
+    # ETag of the uncompressed body.
+    client.simulate_get('/recordings')
+    identity_etag = client.simulate_get('/recordings').headers['ETag']
+    gzip_etag = client.simulate_get('/recordings',
+                                    headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    assert gzip_etag != identity_etag
+
+    response = client.simulate_get('/recordings', headers={'If-None-Match': gzip_etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == identity_etag
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+# Created by bin/load_tables.sql and bin/taxon.sql for the join paths of the resources.
+INDEXES = ['genus_family_id', 'species_genus_id', 'recording_species_id', 'recording_kind',
+           'image_species_id', 'taxon_family_id']
+
+
+def exercise(client):
+    # One request of each kind answered from the database. The whole /recordings listing is
+    # left out: it reads every recording by design.
+    recording = client.simulate_get('/api/recording-quiz').json
+    image = client.simulate_get('/api/image-quiz').json
+    wrong_recording = {'recording_id': recording['recording_id'], 'family_id': 0}
+    wrong_species = {'recording_id': recording['recording_id'], 'species_id': 0}
+    wrong_image = {'image_id': image['image_id'], 'species_id': 0}
+    for method, path, body in [
+        ('GET', '/recording-quiz', None),
+        ('GET', '/image-quiz', None),
+        ('GET', '/images/%d' % image['family_id'], None),
+        ('GET', '/api/recording-quiz/deck', None),
+        ('GET', '/api/image-quiz/deck', None),
+        ('POST', '/recording-quiz', wrong_recording),
+        ('POST', '/recordings', wrong_species),
+        ('POST', '/image-quiz', wrong_image),
+        ('POST', '/api/recording-quiz', wrong_recording),
+        ('POST', '/api/recordings', wrong_species),
+        ('POST', '/api/image-quiz', wrong_image),
+    ]:
+        response = client.simulate_request(method, path, json=body)
+        assert response.status_code == 200, (method, path, response.text)
+
+
+@pytest.fixture
+def request_queries(client, monkeypatch):
+    # The queries run while answering requests, once the per-worker caches (quiz indexes,
+    # catalogues, pages) are built.
+    from jacamar import resources
+
+    exercise(client)
+    exercise(client)
+    resources.page_cache._pages.clear()
+
+    queries = []
+    execute = resources.TimedCursor.execute
+
+    def recording_execute(self, query, parameters=()):
+        queries.append((query, tuple(parameters)))
+        return execute(self, query, parameters)
+
+    monkeypatch.setattr(resources.TimedCursor, 'execute', recording_execute)
+    exercise(client)
+    assert queries
+    return queries
+
+
+def full_scans(db_file, queries):
+    connection = sqlite3.connect(db_file)
+    scans = []
+    for query, parameters in queries:
+        for row in connection.execute('explain query plan ' + query, parameters):
+            if row[3].startswith('SCAN'):
+                scans.append((' '.join(query.split()), row[3]))
+    connection.close()
+    return scans
+
+
+def test_request_queries_use_indexes(db_file, request_queries):
+    assert full_scans(db_file, request_queries) == []
+
+
+def test_request_queries_scan_without_indexes(db_file, request_queries, tmp_path):
+    # The same queries against the database without its indexes, so that the test above
+    # fails if they stop being used.
+    bare_db_file = str(tmp_path / 'bare.sqlite')
+    source = sqlite3.connect(db_file)
+    bare = sqlite3.connect(bare_db_file)
+    source.backup(bare)
+    source.close()
+    for index in INDEXES:
+        bare.execute('drop index %s' % index)
+    bare.close()
+    assert full_scans(bare_db_file, request_queries)
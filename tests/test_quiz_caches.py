@@ -0,0 +1,14 @@
+def test_recording_quiz_caches_shared(db_file):
+    # Built once per worker and database version, not once per resource.
+    from jacamar import api
+
+    assert api.recording_quiz.recording_index is api.recording_quiz_api.recording_index
+    assert api.recording_quiz.family_catalogue is api.recording_quiz_api.family_catalogue
+    assert api.recording_quiz_deck_api.quiz.recording_index is api.recording_quiz.recording_index
+
+
+def test_image_quiz_caches_shared(db_file):
+    from jacamar import api
+
+    assert api.image_quiz.image_index is api.image_quiz_api.image_index
+    assert api.image_quiz.quiz_species is api.image_quiz_api.quiz_species
@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from jacamar import settings
+from jacamar import snapshot
+
+
+def set_build_id(db_file, build_id):
+    connection = sqlite3.connect(db_file)
+    with connection:
+        connection.execute('update build set manifest = ?', (json.dumps({'build_id': build_id}),))
+    connection.close()
+
+
+@pytest.fixture
+def db(db_file, tmp_path, monkeypatch):
+    # A copy of the test database of build 7, with the snapshot of build 7.
+    from update_db import write_snapshot
+    from jacamar import resources
+
+    copy_file = str(tmp_path / 'jacamar.sqlite')
+    source = sqlite3.connect(db_file)
+    copy = sqlite3.connect(copy_file)
+    source.backup(copy)
+    source.close()
+    monkeypatch.setattr(settings, 'snapshot_file', str(tmp_path / 'taxonomy.snapshot'))
+    write_snapshot(copy, settings.snapshot_file, 7)
+    copy.close()
+    set_build_id(copy_file, 7)
+    return resources.Database(copy_file)
+
+
+def test_load(db):
+    assert db.build_id() == 7
+    assert snapshot.load(7).build_id == 7
+    assert snapshot.load(8) is None
+    assert snapshot.load(None) is None
+
+
+def test_recording_path_of_other_build(db):
+    # Once the database is rebuilt with other IDs, the snapshot of the previous build must
+    # not be read for it.
+    from jacamar import resources
+
+    recording = resources.Recording(db)
+    path = recording.get_recording_path(1)
+    connection = sqlite3.connect(db.path)
+    with connection:
+        connection.execute("update recording set path = 'recordings/moved.mp3' where id = 1")
+    connection.close()
+    assert recording.get_recording_path(1) == path
+
+    set_build_id(db.path, 8)
+    assert recording.get_recording_path(1) == 'recordings/moved.mp3'
+
+
+def test_family_species(db):
+    from jacamar import resources
+
+    quiz = resources.RecordingQuizApi(db)
+    taxonomy = snapshot.load(db.build_id())
+    for family in taxonomy.families():
+        species = quiz.get_family_species(family.id)
+        expected = quiz._query_family_species(family.id)
+        for s in species + expected:
+            s['image_urls'].sort()
+        assert species == expected
+
+
+def test_recordings_of_species(db):
+    taxonomy = snapshot.load(db.build_id())
+    connection = sqlite3.connect(db.path)
+    for species_id, in connection.execute('select id from species'):
+        recordings = taxonomy.recordings_of_species(species_id)
+        assert len(recordings) == taxonomy.recording_count(species_id)
+        assert [(r.id, r.path) for r in recordings] == connection.execute(
+            'select id, path from recording where species_id = ? order by id',
+            (species_id,)).fetchall()
+    connection.close()
+
+
+@pytest.mark.parametrize('header', [
+    snapshot.HEADER.pack(snapshot.MAGIC, 1, len(snapshot.SECTIONS), 7),
+    b'',
+    snapshot.MAGIC,
+])
+def test_unreadable_snapshot(db, tmp_path, header):
+    # A snapshot of an older format or a truncated one is ignored, and the database queried.
+    from jacamar import resources
+
+    path = resources.Recording(db).get_recording_path(1)
+    unreadable_file = str(tmp_path / 'unreadable.snapshot')
+    with open(unreadable_file, 'wb') as fp:
+        fp.write(header)
+    os.replace(unreadable_file, settings.snapshot_file)
+    assert snapshot.load(7) is None
+    assert snapshot.load(7) is None
+    assert resources.Recording(db).get_recording_path(1) == path
+    assert resources.RecordingQuizApi(db).get_family_species(1) is not None
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_DIR, require_sqlite3
+
+
+@pytest.fixture
+def build_dir(tmp_path):
+    # A checklist, a recordings directory and the tables built from them, as `make tables`
+    # leaves them.
+    from synthetic import MP3_FRAME, generate_checklist, generate_recording_file_names
+    from create_tables import create_tables
+
+    checklist = generate_checklist(40)
+    (tmp_path / 'checklist.tsv').write_text(''.join(checklist))
+    species_table = create_tables(checklist)[3]
+    os.mkdir(tmp_path / 'recordings')
+    os.mkdir(tmp_path / 'tables')
+    (tmp_path / 'tables' / 'image.tsv').write_text('')
+    *file_names, added_file_name = generate_recording_file_names(species_table, 81)
+    for file_name in file_names:
+        (tmp_path / 'recordings' / file_name).write_bytes(MP3_FRAME * 100)
+    (tmp_path / 'added_file_name').write_text(added_file_name)
+    run(tmp_path, 'create_tables.py', 'checklist.tsv', 'recordings')
+    return tmp_path
+
+
+def run(dir, script, *args):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, 'bin', script), *args], cwd=dir,
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def count_recordings(db_file):
+    connection = sqlite3.connect(db_file)
+    [count] = connection.execute('select count(*) from recording').fetchone()
+    connection.close()
+    return count
+
+
+def test_update_after_tables_rebuilt(build_dir):
+    # The manifest is kept in the database, so a `make tables` run after the database was
+    # built does not hide the changes it picked up from `make db-update`.
+    from synthetic import MP3_FRAME, load_db
+
+    require_sqlite3()
+    load_db(str(build_dir), 'jacamar.sqlite')
+    db_file = str(build_dir / 'jacamar.sqlite')
+    assert count_recordings(db_file) == 80
+
+    added_file_name = (build_dir / 'added_file_name').read_text()
+    (build_dir / 'recordings' / added_file_name).write_bytes(MP3_FRAME * 100)
+    run(build_dir, 'create_tables.py', 'checklist.tsv', 'recordings')
+    run(build_dir, 'update_db.py', 'checklist.tsv', 'recordings', 'jacamar.sqlite')
+    assert count_recordings(db_file) == 81
+
+    run(build_dir, 'update_db.py', 'checklist.tsv', 'recordings', 'jacamar.sqlite')
+    assert count_recordings(db_file) == 81
+
+
+def test_update_without_manifest(build_dir):
+    from synthetic import load_db
+
+    require_sqlite3()
+    os.remove(build_dir / 'tables' / 'manifest.json')
+    load_db(str(build_dir), 'jacamar.sqlite')
+    with pytest.raises(subprocess.CalledProcessError):
+        run(build_dir, 'update_db.py', 'checklist.tsv', 'recordings', 'jacamar.sqlite')
+
+
+def test_snapshot_of_database_build(db_file, build_dir, monkeypatch):
+    # The snapshot written by `make tables` is of a newer build than the database, until
+    # the database is loaded from the same tables or updated.
+    from synthetic import load_db
+    from jacamar import resources, settings, snapshot
+
+    require_sqlite3()
+    load_db(str(build_dir), 'jacamar.sqlite')
+    db = resources.Database(str(build_dir / 'jacamar.sqlite'))
+    monkeypatch.setattr(settings, 'snapshot_file',
+                        str(build_dir / 'tables' / 'taxonomy.snapshot'))
+    assert snapshot.load(db.build_id()) is not None
+
+    run(build_dir, 'create_tables.py', 'checklist.tsv', 'recordings')
+    assert snapshot.load(db.build_id()) is None
+
+    run(build_dir, 'update_db.py', 'checklist.tsv', 'recordings', 'jacamar.sqlite')
+    assert snapshot.load(db.build_id()) is not None
+
+
+def test_sql_statements():
+    from update_db import sql_statements
+
+    script = """-- Drops; then creates.
+drop table if exists t;
+create table t (a text); insert into t values ('x;y');
+create trigger t_insert after insert on t begin
+  insert into t values ('z');
+end;
+-- trailing comment
+"""
+    assert [' '.join(statement.split()) for statement in sql_statements(script)] == [
+        '-- Drops; then creates. drop table if exists t;',
+        'create table t (a text);',
+        "insert into t values ('x;y');",
+        "create trigger t_insert after insert on t begin insert into t values ('z'); end;",
+        '-- trailing comment',
+    ]
+
+
+def test_update_analyzes(build_dir):
+    # The planner statistics count the recordings added by the update.
+    from synthetic import MP3_FRAME, load_db
+
+    require_sqlite3()
+    load_db(str(build_dir), 'jacamar.sqlite')
+    added_file_name = (build_dir / 'added_file_name').read_text()
+    (build_dir / 'recordings' / added_file_name).write_bytes(MP3_FRAME * 100)
+    run(build_dir, 'update_db.py', 'checklist.tsv', 'recordings', 'jacamar.sqlite')
+
+    connection = sqlite3.connect(str(build_dir / 'jacamar.sqlite'))
+    [stat] = connection.execute(
+        "select stat from sqlite_stat1 where idx = 'recording_species_id'").fetchone()
+    connection.close()
+    assert stat.split()[0] == '81'